@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Benchmark the data sync and the API against a synthetic dataset
+
+Generates a TSV with the same 57-column layout as the Google Sheets export,
+serves it from a local stand-in HTTP server, times a full and an incremental
+sync, then drives the API endpoints at each requested concurrency and writes
+throughput and latency percentiles to a JSON file.
+
+    python3 benchmark.py --rows 100000 --concurrency 1,8,32 --output bench.json
+    python3 benchmark.py --rows 100000 --compare bench.json
+"""
+import argparse
+import functools
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from data_sync_sqlite import SOURCE_COLUMNS, SheetSource, SQLiteDataSync
+from export_data import ExportCache
+from simple_api import DashboardAPI, ThreadPoolHTTPServer
+
+SHEET_WIDTH = 57
+
+STATUSES = ["ติดตั้งแล้ว", "รอติดตั้ง", "นัดหมายแล้ว", "ยกเลิก", "รอสินค้า"]
+ITEM_GROUPS = ["AIR", "CURTAIN", "FURNITURE", "BUILT-IN", "LIGHTING", "APPLIANCE"]
+ROOM_TYPES = ["ห้องนอน", "ห้องนั่งเล่น", "ห้องครัว", "ห้องน้ำ", "ระเบียง"]
+PRODUCTS = ["แอร์ 9000 BTU", "ม่านทึบแสง", "โซฟา 3 ที่นั่ง", "ตู้เสื้อผ้า", "โคมไฟเพดาน", "ตู้เย็น 2 ประตู"]
+
+class QuietFileHandler(SimpleHTTPRequestHandler):
+    """Static file handler for the stand-in sheet server, without access logs"""
+    
+    def log_message(self, format, *args):
+        pass
+
+class QuietAPIHandler(DashboardAPI):
+    """DashboardAPI without per-request access logs, which would dominate the timings"""
+    
+    def log_message(self, format, *args):
+        pass
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class DashboardBenchmark:
+    def __init__(self, rows, seed=42, work_dir=None):
+        self.rows = rows
+        self.seed = seed
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="dashboard-bench-")
+        self.tsv_path = os.path.join(self.work_dir, "sheet.tsv")
+        self.db_path = os.path.join(self.work_dir, "dashboard.db")
+        self.projects = []
+    
+    def generate_tsv(self, changed_fraction=0.0):
+        """Write a synthetic sheet export; changed_fraction of the rows get a new status"""
+        rng = random.Random(self.seed)
+        change_rng = random.Random(self.seed + 1)
+        self.projects = [f"PRJ{n:03d}" for n in range(max(1, self.rows // 2500))]
+        brands = [f"BRAND{n:02d}" for n in range(25)]
+        suppliers = [f"Supplier {n}" for n in range(12)]
+        
+        header = [f"column_{n}" for n in range(SHEET_WIDTH)]
+        for name, position in SOURCE_COLUMNS.items():
+            header[position] = name
+        
+        with open(self.tsv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("\t".join(header) + "\n")
+            written = 0
+            order = 0
+            while written < self.rows:
+                order += 1
+                project = rng.choice(self.projects)
+                unit = f"{rng.randint(1, 40):02d}{rng.randint(1, 30):02d}"
+                year = rng.choice([2023, 2024, 2025])
+                month = rng.randint(1, 12)
+                order_date = f"{rng.randint(1, 28):02d}/{month:02d}/{year}"
+                for _ in range(min(rng.randint(1, 5), self.rows - written)):
+                    row = [""] * SHEET_WIDTH
+                    cost = rng.uniform(500, 80000)
+                    status = rng.choice(STATUSES)
+                    if changed_fraction and change_rng.random() < changed_fraction:
+                        status = change_rng.choice(STATUSES[:2])
+                    row[0] = f"SO{order:07d}"
+                    row[1] = order_date
+                    row[2] = order_date
+                    row[6] = project
+                    row[8] = f"Project {project}"
+                    row[9] = unit
+                    row[10] = f"{rng.randint(1, 999)}/{rng.randint(1, 300)}"
+                    row[13] = f"ลูกค้า {order % 5000}"
+                    row[14] = f"08{rng.randint(10000000, 99999999)}"
+                    row[22] = rng.choice(ITEM_GROUPS)
+                    row[23] = rng.choice(PRODUCTS)
+                    row[24] = rng.choice(["ขาว", "ดำ", "เทา", ""])
+                    row[25] = rng.choice(brands)
+                    row[27] = rng.choice(ROOM_TYPES)
+                    row[35] = rng.choice(suppliers)
+                    row[43] = f"{rng.randint(1, 28):02d}/{month:02d}/{year}"
+                    row[47] = status
+                    row[48] = f"{cost:,.2f}"
+                    row[49] = f"{cost * 1.07:,.2f}"
+                    row[50] = f"{cost * 1.3:,.2f}"
+                    row[51] = f"{cost * 1.3 * 1.07:,.2f}"
+                    row[53] = str(month)
+                    row[54] = str(year)
+                    row[55] = f"B{rng.randint(1, 4)}"
+                    row[56] = str(rng.randint(1, 40))
+                    f.write("\t".join(row) + "\n")
+                    written += 1
+        
+        return os.path.getsize(self.tsv_path)
+    
+    def serve_sheet(self):
+        """Serve work_dir over HTTP on an ephemeral port; returns (server, url)"""
+        handler = functools.partial(QuietFileHandler, directory=self.work_dir)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f"http://127.0.0.1:{server.server_address[1]}/sheet.tsv"
+    
+    def time_sync(self, sync, incremental):
+        """Run one sync and return its wall time, phase timings and row counts"""
+        started = time.perf_counter()
+        sync.run_sync(incremental=incremental)
+        elapsed = time.perf_counter() - started
+        return {
+            "seconds": round(elapsed, 4),
+            "rows_per_second": round(self.rows / elapsed),
+            "phases": {name: round(seconds, 4) for name, seconds in sync.phase_timings.items()},
+            "counts": dict(sync.sync_counts),
+            "sources": {name: {key: round(value, 4) for key, value in timing.items()} for name, timing in sync.source_timings.items()},
+        }
+    
+    def bench_sync(self):
+        """Time fetch and parse on their own, then a full, a no-op and a partial incremental sync"""
+        results = {"tsv_bytes": self.generate_tsv()}
+        server, url = self.serve_sheet()
+        try:
+            sync = SQLiteDataSync(self.db_path)
+            sync.report_path = os.path.join(self.work_dir, "sync_report.json")
+            # The generated header names every synced field, so map columns by name
+            source = SheetSource("benchmark", url, {name: name for name in SOURCE_COLUMNS})
+            sync.sources = [source]
+            
+            started = time.perf_counter()
+            rows = list(sync.fetch_tsv_data(source))
+            results["fetch_seconds"] = round(time.perf_counter() - started, 4)
+            
+            started = time.perf_counter()
+            for _ in sync.parse_rows(rows, source):
+                pass
+            results["parse_seconds"] = round(time.perf_counter() - started, 4)
+            del rows
+            
+            results["full"] = self.time_sync(sync, incremental=False)
+            results["incremental_unchanged"] = self.time_sync(sync, incremental=True)
+            
+            self.generate_tsv(changed_fraction=0.05)
+            # Last-Modified has one-second resolution; make sure the rewrite is not mistaken for the old file
+            modified = time.time() + 2
+            os.utime(self.tsv_path, (modified, modified))
+            results["incremental_5pct_changed"] = self.time_sync(sync, incremental=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+        return results
+    
+    def endpoints(self):
+        """Representative API requests for the generated dataset"""
+        project = self.projects[0]
+        return {
+            "stats": "/api/stats",
+            "projects": "/api/projects",
+            "status": "/api/status",
+            "data_100": "/api/data?limit=100",
+            "data_1000": "/api/data?limit=1000",
+            "data_project": f"/api/data?project_code={project}&limit=100",
+            "data_deep_offset": "/api/data?limit=100&offset=" + str(max(0, self.rows - 200)),
+            "revenue_month": "/api/revenue?group_by=brand,sales_year,sales_month",
+            "export_project": f"/api/export?project_code={project}",
+        }
+    
+    def drive(self, base_url, path, requests, concurrency, gzip_body):
+        """Issue requests against one endpoint and summarise latency and throughput"""
+        headers = {"Accept-Encoding": "gzip"} if gzip_body else {}
+        
+        def fetch(_):
+            started = time.perf_counter()
+            with urllib.request.urlopen(urllib.request.Request(base_url + path, headers=headers), timeout=60) as response:
+                size = len(response.read())
+            return time.perf_counter() - started, size
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(fetch, range(requests)))
+        elapsed = time.perf_counter() - started
+        
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        return {
+            "requests": requests,
+            "throughput_rps": round(requests / elapsed, 1),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "response_bytes": samples[0][1],
+        }
+    
+    def bench_api(self, concurrency_levels, requests, workers, cache_bytes, gzip_body):
+        """Drive every endpoint at each concurrency level against the synced database"""
+        server = ThreadPoolHTTPServer(("127.0.0.1", 0), QuietAPIHandler, self.db_path,
+                                      pool_size=workers, workers=workers, cache_bytes=cache_bytes)
+        server.exports = ExportCache(os.path.join(self.work_dir, "exports"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        
+        results = {}
+        try:
+            for name, path in self.endpoints().items():
+                results[name] = {}
+                for concurrency in concurrency_levels:
+                    results[name][str(concurrency)] = self.drive(base_url, path, requests, concurrency, gzip_body)
+                    summary = results[name][str(concurrency)]
+                    print(f"  {name:<18} c={concurrency:<4} {summary['throughput_rps']:>9.1f} req/s"
+                          f"  p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  p99 {summary['p99_ms']:>8.2f} ms")
+        finally:
+            server.shutdown()
+            server.server_close()
+        return results
+
+def compare(previous, current):
+    """Print the change in sync time and API p99/throughput relative to an earlier run"""
+    def delta(old, new):
+        return f"{old:>10.3f} -> {new:>10.3f} ({(new - old) / old * 100 if old else 0:+6.1f}%)"
+    
+    print("\n=== Comparison with previous run ===")
+    for mode in ("full", "incremental_unchanged", "incremental_5pct_changed"):
+        if mode in previous.get("sync", {}) and mode in current["sync"]:
+            print(f"sync {mode:<26} s   {delta(previous['sync'][mode]['seconds'], current['sync'][mode]['seconds'])}")
+    for name, levels in current["api"].items():
+        for concurrency, summary in levels.items():
+            old = previous.get("api", {}).get(name, {}).get(concurrency)
+            if old:
+                print(f"{name:<18} c={concurrency:<4} p99 ms  {delta(old['p99_ms'], summary['p99_ms'])}")
+                print(f"{name:<18} c={concurrency:<4} req/s   {delta(old['throughput_rps'], summary['throughput_rps'])}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard sync and API on synthetic data")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows in the generated sheet")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated client concurrency levels")
+    parser.add_argument("--workers", type=int, default=16, help="API worker threads")
+    parser.add_argument("--cache-bytes", type=int, default=0, help="API response cache budget (default 0: measure uncached)")
+    parser.add_argument("--gzip", action="store_true", help="Request gzip-compressed responses")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated TSV and database")
+    args = parser.parse_args()
+    
+    bench = DashboardBenchmark(args.rows, args.seed)
+    print(f"Working directory: {bench.work_dir}")
+    try:
+        print(f"\n=== Sync benchmark ({args.rows:,} rows) ===")
+        sync_results = bench.bench_sync()
+        
+        print("\n=== API benchmark ===")
+        concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+        api_results = bench.bench_api(concurrency_levels, args.requests, args.workers, args.cache_bytes, args.gzip)
+        
+        results = {
+            "timestamp": datetime.now().isoformat(),
+            "config": vars(args),
+            "sync": sync_results,
+            "api": api_results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+        
+        if args.compare:
+            with open(args.compare) as f:
+                compare(json.load(f), results)
+    finally:
+        if not args.keep:
+            shutil.rmtree(bench.work_dir, ignore_errors=True)
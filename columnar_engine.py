@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""In-memory columnar snapshot of dashboard_data for ad-hoc aggregates
+
+Low-cardinality columns are dictionary-encoded: each distinct value gets an
+integer code, the per-row codes live in an array, and every code also keeps a
+row bitmap (a Python int with bit i set when row i holds that value). Filters
+and group-bys are then AND/OR of bitmaps and popcounts, which run in C over
+64 rows per machine word. Money columns are packed into array('d') and only
+summed for the rows a group selects.
+
+simple_api.py uses this for /api/aggregate when API_COLUMNAR=1 and reloads the
+snapshot whenever the sync version changes.
+"""
+import array
+import itertools
+import math
+import threading
+import time
+
+# Columns that can be grouped and filtered on
+DIMENSIONS = (
+    'project_code', 'project_name', 'brand', 'install_status', 'document_status',
+    'items_group', 'supplier_name', 'room_type', 'building', 'floor_level',
+    'sales_year', 'sales_month',
+)
+
+# Columns that can be summed
+MEASURES = ('cost_total_ex_vat', 'cost_total_in_vat', 'sale_total_ex_vat', 'sale_total_in_vat')
+
+# '0'/'1' characters -> 0/1 bytes, for turning a bitmap into an itertools.compress selector
+SELECTOR_TABLE = bytes.maketrans(b'01', b'\x00\x01')
+
+# Up to this many groups, sums use one selector per group; beyond it one pass over the rows is cheaper
+SELECTOR_GROUP_LIMIT = 8
+
+# Above this many possible value combinations, group-bys count rows in one pass instead of splitting bitmaps
+BITMAP_SPLIT_LIMIT = 256
+
+class DictionaryColumn:
+    """A column stored as integer codes into its table of distinct values"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.values = []
+        # Filter values arrive as query-string text; NULL is looked up as ''
+        self.index = {}
+        self.codes = array.array('I')
+        self.bitmaps = []
+    
+    def load(self, values):
+        codes_by_value = {}
+        codes = self.codes
+        for value in values:
+            code = codes_by_value.get(value)
+            if code is None:
+                code = codes_by_value[value] = len(self.values)
+                self.values.append(value)
+            codes.append(code)
+        self.index = {('' if value is None else str(value)): code for value, code in codes_by_value.items()}
+        self.build_bitmaps()
+    
+    def build_bitmaps(self):
+        """Build one row bitmap per code with a single pass over the rows"""
+        row_count = len(self.codes)
+        rows_by_code = [[] for _ in self.values]
+        for row, code in enumerate(self.codes):
+            rows_by_code[code].append(row)
+        
+        self.bitmaps = []
+        for rows in rows_by_code:
+            # int(..., 2) reads the most significant bit first, so row i sits at position row_count - 1 - i
+            digits = bytearray(b'0' * row_count)
+            for row in rows:
+                digits[row_count - 1 - row] = 49
+            self.bitmaps.append(int(digits, 2))
+    
+    def select(self, values):
+        """Bitmap of the rows holding any of values"""
+        bitmap = 0
+        for value in values:
+            code = self.index.get(value)
+            if code is not None:
+                bitmap |= self.bitmaps[code]
+        return bitmap
+
+class ColumnarSnapshot:
+    """dashboard_data as of one sync version, held column by column"""
+    
+    def __init__(self, version, synced_at, cursor):
+        self.version = version
+        self.synced_at = synced_at
+        started = time.perf_counter()
+        
+        cursor.execute(f"SELECT {', '.join(DIMENSIONS + MEASURES)} FROM dashboard_data ORDER BY id")
+        rows = cursor.fetchall()
+        self.row_count = len(rows)
+        self.all_rows = (1 << self.row_count) - 1
+        
+        columns = list(zip(*rows)) if rows else [() for _ in DIMENSIONS + MEASURES]
+        del rows
+        self.dimensions = {}
+        for name, values in zip(DIMENSIONS, columns):
+            column = DictionaryColumn(name)
+            column.load(values)
+            self.dimensions[name] = column
+        # NULL amounts count as 0, matching SQL TOTAL()
+        self.measures = {
+            name: array.array('d', (value or 0.0 for value in values))
+            for name, values in zip(MEASURES, columns[len(DIMENSIONS):])
+        }
+        
+        self.load_seconds = time.perf_counter() - started
+        print(f"Loaded columnar snapshot of version {version}: {self.row_count:,} rows in {self.load_seconds:.2f}s")
+    
+    def selector(self, bitmap):
+        """Per-row 0/1 bytes for bitmap, in row order"""
+        return format(bitmap, 'b').zfill(self.row_count)[::-1].encode('ascii').translate(SELECTOR_TABLE)
+    
+    def aggregate(self, group_by=(), filters=None, measures=()):
+        """Count (and sum measures over) the rows matching filters, grouped by group_by
+        
+        filters maps a dimension to the values it may take. Returns
+        (total matching rows, [(group key tuple, count, {measure: sum})]).
+        """
+        mask = self.all_rows
+        for name, values in (filters or {}).items():
+            mask &= self.dimensions[name].select(values)
+        
+        combinations = math.prod(len(self.dimensions[name].values) for name in group_by)
+        if combinations > BITMAP_SPLIT_LIMIT:
+            return mask.bit_count(), self.scan_groups(mask, group_by, measures)
+        
+        # Split the mask one dimension at a time, dropping empty groups as we go
+        groups = [((), mask)]
+        for name in group_by:
+            column = self.dimensions[name]
+            split = []
+            for key, group_mask in groups:
+                for value, bitmap in zip(column.values, column.bitmaps):
+                    rows = group_mask & bitmap
+                    if rows:
+                        split.append((key + (value,), rows))
+            groups = split
+        
+        if measures and len(groups) > SELECTOR_GROUP_LIMIT:
+            return mask.bit_count(), self.scan_groups(mask, group_by, measures)
+        
+        results = []
+        for key, rows in groups:
+            sums = {}
+            if measures:
+                selector = self.selector(rows)
+                for name in measures:
+                    sums[name] = math.fsum(itertools.compress(self.measures[name], selector))
+            results.append((key, rows.bit_count(), sums))
+        return mask.bit_count(), results
+    
+    def scan_groups(self, mask, group_by, measures):
+        """Count rows and sum measures per group key in a single pass over the rows in mask"""
+        selector = self.selector(mask)
+        columns = [self.dimensions[name] for name in group_by]
+        keys = list(zip(*(itertools.compress(column.codes, selector) for column in columns)))
+        
+        counts = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        sums = {key: {} for key in counts}
+        for name in measures:
+            totals = dict.fromkeys(counts, 0.0)
+            for key, amount in zip(keys, itertools.compress(self.measures[name], selector)):
+                totals[key] += amount
+            for key, total in totals.items():
+                sums[key][name] = total
+        
+        return [
+            (tuple(column.values[code] for column, code in zip(columns, codes)), count, sums[codes])
+            for codes, count in counts.items()
+        ]
+
+class ColumnarEngine:
+    """Keeps one ColumnarSnapshot, replacing it when a request sees a newer sync version"""
+    
+    def __init__(self):
+        self.snapshot = None
+        self._lock = threading.Lock()
+    
+    def get(self, version, synced_at, cursor):
+        """Return the snapshot for version, loading it through cursor if needed
+        
+        cursor must be inside a read transaction at that version so the
+        columns match what the rest of the response sees. synced_at orders
+        versions, since a rebuilt database counts generations from 1 again.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self.snapshot
+            if (snapshot is not None and synced_at is not None and snapshot.synced_at is not None
+                    and synced_at < snapshot.synced_at):
+                # A request that started before the latest sync; answer it without replacing the newer snapshot
+                return ColumnarSnapshot(version, synced_at, cursor)
+            if snapshot is None or snapshot.version != version:
+                # Drop the old columns before building the new ones to cap peak memory
+                self.snapshot = None
+                snapshot = self.snapshot = ColumnarSnapshot(version, synced_at, cursor)
+            return snapshot
@@ -1,220 +1,1323 @@
 #!/usr/bin/env python3
 import urllib.request
+import urllib.error
+import http.client
 import sqlite3
 import csv
-from datetime import datetime
+import io
+import hashlib
+import secrets
+import itertools
+import operator
+import argparse
+import sys
+import time
+import random
+import signal
+import threading
+import tempfile
+import json
+import math
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date
 import os
 
+# Bump whenever the dashboard_rows layout changes; older databases get a full reload
+SCHEMA_VERSION = 7
+
+# Default column mapping: 0-based position in the sheet of every synced field
+SOURCE_COLUMNS = {
+    'order_number': 0,
+    'order_date': 1,
+    'payment_date': 2,
+    'project_code': 6,
+    'project_name': 8,
+    'unit_no': 9,
+    'house_number': 10,
+    'unit_status': 11,
+    'contact_name': 13,
+    'contact_phone': 14,
+    'product_type': 18,
+    'product_group': 19,
+    'items_group': 22,
+    'product_detail': 23,
+    'color': 24,
+    'brand': 25,
+    'product_size': 26,
+    'room_type': 27,
+    'install_point': 28,
+    'install_size': 29,
+    'supplier_name': 35,
+    'po_number': 36,
+    'po_date': 37,
+    'install_confirm_date': 41,
+    'install_time_slot': 42,
+    'install_date': 43,
+    'delivery_date': 44,
+    'notes': 45,
+    'document_status': 46,
+    'install_status': 47,
+    'cost_total_ex_vat': 48,
+    'cost_total_in_vat': 49,
+    'sale_total_ex_vat': 50,
+    'sale_total_in_vat': 51,
+    'sales_month': 53,
+    'sales_year': 54,
+    'building': 55,
+    'floor_level': 56,
+}
+
+INT_COLUMNS = ('sales_month', 'sales_year')
+FLOAT_COLUMNS = ('cost_total_ex_vat', 'cost_total_in_vat', 'sale_total_ex_vat', 'sale_total_in_vat')
+
+# Returned by parse_int/parse_float for a cell that is not a number; it is stored as NULL and
+# counted in the sync report
+INVALID = object()
+
+# Stored as YYYY-MM-DD so they sort and compare chronologically; a blank or unparseable cell is NULL.
+# order_date is the exception: it is the /api/data sort key and the keyset cursor cannot step over
+# NULLs, so a missing order date is '' (which sorts before every date, i.e. last in DESC order).
+DATE_COLUMNS = ('order_date', 'payment_date', 'po_date', 'install_confirm_date', 'install_date', 'delivery_date')
+
+# Repeated strings kept once in a dim_<column> table (id INTEGER PRIMARY KEY, value TEXT UNIQUE).
+# dashboard_rows stores the integer <column>_id; the dashboard_data view joins the values back.
+DIMENSION_COLUMNS = (
+    'source', 'project_code', 'project_name', 'unit_status', 'product_type', 'product_group',
+    'items_group', 'color', 'brand', 'room_type', 'supplier_name', 'install_time_slot',
+    'document_status', 'install_status', 'building', 'floor_level',
+)
+
+# Rollups behind /api/stats, /api/projects and /api/status, rebuilt whenever the data changes:
+# table -> (column definitions, query that fills it from dashboard_rows)
+# Rows are grouped on the integer dimension keys and the names looked up once per group.
+SUMMARY_TABLES = {
+    'summary_totals': (
+        "total_records INTEGER, unique_projects INTEGER",
+        """SELECT (SELECT COUNT(*) FROM dashboard_rows),
+                  (SELECT COUNT(*) FROM dim_project_code WHERE value != '' AND id IN (SELECT project_code_id FROM dashboard_rows))"""
+    ),
+    'summary_status': (
+        "install_status TEXT PRIMARY KEY, record_count INTEGER, percentage REAL",
+        """SELECT s.value, g.record_count, ROUND(g.record_count * 100.0 / (SELECT COUNT(*) FROM dashboard_rows), 2)
+           FROM (SELECT install_status_id, COUNT(*) AS record_count FROM dashboard_rows GROUP BY install_status_id) AS g
+           JOIN dim_install_status AS s ON s.id = g.install_status_id WHERE s.value != ''"""
+    ),
+    'summary_monthly': (
+        "sales_year INTEGER, sales_month INTEGER, record_count INTEGER, PRIMARY KEY (sales_year, sales_month)",
+        """SELECT sales_year, sales_month, COUNT(*) FROM dashboard_rows
+           WHERE sales_year IS NOT NULL AND sales_month IS NOT NULL GROUP BY sales_year, sales_month"""
+    ),
+    'summary_brands': (
+        "brand TEXT PRIMARY KEY, record_count INTEGER",
+        """SELECT b.value, g.record_count
+           FROM (SELECT brand_id, COUNT(*) AS record_count FROM dashboard_rows GROUP BY brand_id) AS g
+           JOIN dim_brand AS b ON b.id = g.brand_id WHERE b.value != ''"""
+    ),
+    'summary_projects': (
+        "project_code TEXT, project_name TEXT, record_count INTEGER, latest_install TEXT",
+        """SELECT c.value, n.value, g.record_count, g.latest_install
+           FROM (SELECT project_code_id, project_name_id, COUNT(*) AS record_count, MAX(install_date) AS latest_install
+                 FROM dashboard_rows GROUP BY project_code_id, project_name_id) AS g
+           JOIN dim_project_code AS c ON c.id = g.project_code_id
+           JOIN dim_project_name AS n ON n.id = g.project_name_id
+           WHERE c.value != ''"""
+    ),
+}
+
+# Revenue cubes behind /api/revenue: row counts and FLOAT_COLUMNS totals per combination of
+# their dimensions. The first cube is rolled up from dashboard_rows and the rest from it.
+# Every cube includes CUBE_PARTITION, so incremental syncs only recompute the
+# (sales_year, sales_month) partitions whose rows changed.
+CUBE_PARTITION = ('sales_year', 'sales_month')
+CUBES = {
+    'cube_revenue': ('project_code', 'brand', 'items_group', 'supplier_name') + CUBE_PARTITION,
+    'cube_revenue_project': ('project_code',) + CUBE_PARTITION,
+    'cube_revenue_brand': ('brand',) + CUBE_PARTITION,
+    'cube_revenue_items_group': ('items_group',) + CUBE_PARTITION,
+    'cube_revenue_supplier': ('supplier_name',) + CUBE_PARTITION,
+    'cube_revenue_period': CUBE_PARTITION,
+}
+
+# Fields of a parsed row, in order: sheet fields, then the source and bookkeeping columns
+DATA_COLUMNS = tuple(SOURCE_COLUMNS) + ('source', 'line_no', 'row_hash', 'sync_timestamp')
+# The dashboard_rows columns they are written to, in INSERT order
+ROW_COLUMNS = tuple(f"{c}_id" if c in DIMENSION_COLUMNS else c for c in DATA_COLUMNS)
+
+# Sheets to ingest. SYNC_SOURCES is a JSON list, inline or in a file it names, of
+#   {"name": "north", "url": "https://...&output=tsv", "columns": {"order_number": "Order No", ...}}
+# where each column is a header name (looked up once per download) or a 0-based position, and
+# fields left out are stored empty. Without it the single GOOGLE_SHEETS_TSV_URL sheet is read
+# with the SOURCE_COLUMNS positions.
+DEFAULT_TSV_URL = os.getenv("GOOGLE_SHEETS_TSV_URL", "https://docs.google.com/spreadsheets/d/e/2PACX-1vT5Qu2gRWD_hZX45QY1AyOK0Wl2QEKtR1yjMqQNWWUv7RuAPWwjLCsxsPSp7RcD0HU0tgeiXlwfRMB0/pub?gid=558973433&single=true&output=tsv")
+SOURCES_CONFIG = os.getenv("SYNC_SOURCES", "")
+
+# Sheets downloaded and parsed at the same time; a single writer inserts what they produce
+FETCH_WORKERS = int(os.getenv("SYNC_FETCH_WORKERS", "4"))
+
+# Full-text index behind /api/search, kept in step with dashboard_rows by triggers
+SEARCH_TABLE = "dashboard_search"
+SEARCH_COLUMNS = ('product_detail', 'contact_name')
+
+# Rows per executemany() call
+DEFAULT_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "5000"))
+
+# Download behaviour: attempts after the first, and the socket timeout per attempt
+FETCH_RETRIES = int(os.getenv("SYNC_FETCH_RETRIES", "4"))
+FETCH_TIMEOUT = float(os.getenv("SYNC_FETCH_TIMEOUT", "30"))
+FETCH_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# Responses worth retrying; anything else is treated as a permanent failure
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Daemon mode: seconds between polls of the sheet, randomized by up to +/- SYNC_JITTER
+DEFAULT_INTERVAL = float(os.getenv("SYNC_INTERVAL", "300"))
+DEFAULT_JITTER = float(os.getenv("SYNC_JITTER", "30"))
+
+# simple_api.py writes its pid here; it is sent SIGUSR1 whenever a sync changes the data
+API_PIDFILE = os.getenv("API_PIDFILE", "/tmp/dashboard-api.pid")
+
+# Each sync writes its report (phase timings, row counts, rejected rows) here as JSON, and to sync_runs (empty disables the file)
+SYNC_REPORT_PATH = os.getenv("SYNC_REPORT_PATH", "sync_report.json")
+
+# Where a sync's time goes, in the order the report lists them. fetch and parse are summed over
+# the sheets, which are read in parallel with the writes, so the phases can add up to more than the run
+SYNC_PHASES = ('fetch', 'parse', 'write', 'index', 'stats')
+
+# Columns added to sync_runs after its first version, with their types
+SYNC_RUN_COLUMNS = tuple((f"{phase}_seconds", "REAL") for phase in SYNC_PHASES) + (
+    ('total_seconds', 'REAL'),
+    ('rows_received', 'INTEGER'),
+    ('rows_per_second', 'REAL'),
+    ('rejected', 'INTEGER'),
+    ('report', 'TEXT'),
+)
+
+# Full reloads are built here and swapped in once complete
+SHADOW_TABLE = "dashboard_rows_shadow"
+SEARCH_SHADOW_TABLE = "dashboard_search_shadow"
+
+# Indexes maintained on dashboard_rows: name -> (uniqueness, column list)
+# Each one backs a filter/sort combination or aggregate used by simple_api.py;
+# run `python3 simple_api.py --explain` to check the query plans.
+INDEXES = {
+    # Row identity used by incremental syncs: source sheet, order number and line position within the order
+    'row_key': ('UNIQUE', 'source_id, order_number, line_no'),
+    # /api/data without filters, sorted by order date
+    'order_date': ('', 'order_date'),
+    # /api/data filters, each followed by the sort column so no temp B-tree is needed
+    'project_date': ('', 'project_code_id, order_date'),
+    'status_date': ('', 'install_status_id, order_date'),
+    'brand_date': ('', 'brand_id, order_date'),
+    # /api/room and /api/data?project_code=&unit_no=
+    'room': ('', 'project_code_id, unit_no, order_date'),
+    # Monthly breakdown in /api/stats
+    'sales_period': ('', 'sales_year, sales_month'),
+    # Covering index for the /api/projects rollup
+    'project_summary': ('', 'project_code_id, project_name_id, install_date'),
+    # Install date ranges in /api/search
+    'install_date': ('', 'install_date'),
+}
+
+def dimension_names(alias, columns):
+    """SELECT expressions reading columns of alias by name, and the joins they need
+    
+    Dimension columns are read from their dim_ table through alias's key;
+    other columns come from alias as they are.
+    """
+    names = []
+    joins = ''
+    for column in columns:
+        if column in DIMENSION_COLUMNS:
+            names.append(f"dim_{column}.value")
+            joins += f" JOIN dim_{column} ON dim_{column}.id = {alias}.{column}_id"
+        else:
+            names.append(f"{alias}.{column}")
+    return names, joins
+
+def parse_float(text):
+    """Value of a non-empty numeric cell: a float, None if it is blank, or INVALID"""
+    # Amounts arrive with thousands separators ("59,049.46"); float() handles the rest, surrounding spaces included
+    try:
+        value = float(text.replace(',', '') if ',' in text else text)
+    except ValueError:
+        return None if text.isspace() else INVALID
+    return value if math.isfinite(value) else INVALID
+
+def parse_int(text):
+    """parse_float for whole-number cells; "2024.0" is read as 2024"""
+    try:
+        return int(text)
+    except ValueError:
+        value = parse_float(text)
+        return int(value) if isinstance(value, float) else value
+
+class ParseReport:
+    """Rows a sheet's parse rejected and cells it could not read, counted by cause and by column
+    
+    Blank lines (a sheet export usually ends with some) are only counted as
+    skipped; they are not a data problem.
+    """
+    
+    # Sheet line numbers kept per cause, to find the offending rows
+    EXAMPLE_LINES = 5
+    
+    def __init__(self):
+        self.rejected = {}
+        self.invalid_values = {}
+        self.skipped = 0
+    
+    def count(self, table, key, line_number):
+        entry = table.setdefault(key, {"rows": 0, "lines": []})
+        entry["rows"] += 1
+        if len(entry["lines"]) < self.EXAMPLE_LINES:
+            entry["lines"].append(line_number)
+            return entry
+        return None
+    
+    def reject(self, cause, line_number):
+        self.count(self.rejected, cause, line_number)
+    
+    def invalid(self, column, line_number, text):
+        """Count a cell stored as NULL, keeping its sheet text alongside the example lines"""
+        entry = self.count(self.invalid_values, column, line_number)
+        if entry is not None:
+            entry.setdefault("values", []).append(text)
+
+class SheetSource:
+    """One sheet to ingest: where to download it and where its fields are"""
+    
+    def __init__(self, name, url, columns=None):
+        unknown = set(columns or ()) - set(SOURCE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Source {name}: unknown columns {', '.join(sorted(unknown))}")
+        self.name = name
+        self.url = url
+        # field -> header name or 0-based position
+        self.columns = dict(columns) if columns else dict(SOURCE_COLUMNS)
+    
+    def positions(self, header):
+        """Resolve the mapping against a header row; returns field -> position (None if unmapped)"""
+        by_title = {}
+        for position, title in enumerate(header):
+            by_title.setdefault(title.strip().casefold(), position)
+        
+        positions = {}
+        missing = []
+        for field in SOURCE_COLUMNS:
+            column = self.columns.get(field)
+            if column is None or isinstance(column, int):
+                positions[field] = column
+            elif column.strip().casefold() in by_title:
+                positions[field] = by_title[column.strip().casefold()]
+            else:
+                missing.append(f"{field} ({column})")
+        # Failing here beats silently reading every field from the wrong column
+        if missing:
+            raise ValueError(f"Source {self.name}: no header column for {', '.join(missing)}")
+        return positions
+
+def load_sources(config=SOURCES_CONFIG):
+    """Parse the SYNC_SOURCES configuration into SheetSource objects"""
+    config = config.strip()
+    if not config:
+        return [SheetSource("default", DEFAULT_TSV_URL)]
+    if not config.startswith('['):
+        with open(config, encoding='utf-8') as f:
+            config = f.read()
+    
+    sources = [SheetSource(entry['name'], entry['url'], entry.get('columns')) for entry in json.loads(config)]
+    names = [source.name for source in sources]
+    if not sources or len(set(names)) != len(names):
+        raise ValueError("SYNC_SOURCES must list at least one source, each with a unique name")
+    return sources
+
+class SourceSnapshot:
+    """A downloaded copy of one sheet export, spooled to a temporary file"""
+    
+    def __init__(self, name, file, etag, last_modified, content_hash):
+        self.name = name
+        self.file = file
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+    
+    def rows(self):
+        """Yield the TSV rows of the download"""
+        self.file.seek(0)
+        stream = io.TextIOWrapper(self.file, encoding='utf-8', newline='')
+        line_count = 0
+        try:
+            # Sheets' TSV export never quotes fields, so quote characters are literal
+            for row in csv.reader(stream, delimiter='\t', quoting=csv.QUOTE_NONE):
+                line_count += 1
+                yield row
+        finally:
+            stream.detach()
+        print(f"[{self.name}] Read {line_count} lines from TSV")
+    
+    def close(self):
+        self.file.close()
+
 class SQLiteDataSync:
-    def __init__(self, db_path="dashboard.db"):
+    def __init__(self, db_path="dashboard.db", batch_size=DEFAULT_BATCH_SIZE):
         self.db_path = db_path
-        self.tsv_url = os.getenv("GOOGLE_SHEETS_TSV_URL", "https://docs.google.com/spreadsheets/d/e/2PACX-1vT5Qu2gRWD_hZX45QY1AyOK0Wl2QEKtR1yjMqQNWWUv7RuAPWwjLCsxsPSp7RcD0HU0tgeiXlwfRMB0/pub?gid=558973433&single=true&output=tsv")
-        
+        self.batch_size = batch_size
+        self.api_pidfile = API_PIDFILE
+        self.fetch_retries = FETCH_RETRIES
+        self.fetch_timeout = FETCH_TIMEOUT
+        self.fetch_workers = FETCH_WORKERS
+        self.report_path = SYNC_REPORT_PATH
+        self.sources = load_sources()
+        self.sync_counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        self.phase_timings = {}
+        # Per run: downloads that changed, fetch/parse seconds and row count per source, and what each parse rejected
+        self.snapshots = []
+        self.source_timings = {}
+        self.parse_reports = {}
+    
+    @contextmanager
+    def timed_phase(self, name):
+        """Record the wall-clock seconds spent in one phase of the sync"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_timings[name] = self.phase_timings.get(name, 0.0) + time.perf_counter() - started
+    
+    def connect(self):
+        """Open a write connection in WAL mode so API readers are never blocked"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+    
+    def create_meta_tables(self, cursor):
+        """Create the bookkeeping tables used to track sync state"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT,
+                finished_at TEXT,
+                mode TEXT,
+                inserted INTEGER,
+                updated INTEGER,
+                deleted INTEGER,
+                unchanged INTEGER
+            )
+        """)
+        # Databases from before the sync report lack its columns
+        cursor.execute("PRAGMA table_info(sync_runs)")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, declared in SYNC_RUN_COLUMNS:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE sync_runs ADD COLUMN {name} {declared}")
+    
+    def schema_version(self):
+        """Return the schema version recorded in the database (0 if unknown)"""
+        if not os.path.exists(self.db_path):
+            return 0
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT value FROM sync_meta WHERE key = 'schema_version'").fetchone()
+            return int(row[0]) if row else 0
+        except sqlite3.Error:
+            return 0
+        finally:
+            conn.close()
+    
+    def is_ready(self):
+        """Check that the database has the current schema and contains data"""
+        if self.schema_version() != SCHEMA_VERSION:
+            return False
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM dashboard_data").fetchone()[0] > 0
+        except sqlite3.Error:
+            return False
+        finally:
+            conn.close()
+    
     def create_database(self):
-        """Create SQLite database and table"""
+        """Create SQLite database and an empty shadow table to load into"""
         print("Creating SQLite database...")
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
-        # Drop existing table if it exists
-        cursor.execute("DROP TABLE IF EXISTS dashboard_data")
+        self.create_meta_tables(cursor)
+        self.create_dimension_tables(cursor)
+        
+        # Drop a shadow table left behind by an interrupted sync
+        cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+        self.create_data_table(cursor, SHADOW_TABLE)
         
+        conn.commit()
+        conn.close()
+        print("Database created successfully!")
+    
+    def create_data_table(self, cursor, table):
+        """Create a table with the dashboard_rows layout"""
         # Create table with relevant columns based on your TSV structure
-        cursor.execute("""
-            CREATE TABLE dashboard_data (
+        cursor.execute(f"""
+            CREATE TABLE {table} (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_id INTEGER,
                 order_number TEXT,
+                line_no INTEGER,
                 order_date TEXT,
                 payment_date TEXT,
-                project_code TEXT,
-                project_name TEXT,
+                project_code_id INTEGER,
+                project_name_id INTEGER,
                 unit_no TEXT,
                 house_number TEXT,
-                unit_status TEXT,
+                unit_status_id INTEGER,
                 contact_name TEXT,
                 contact_phone TEXT,
-                product_type TEXT,
-                product_group TEXT,
+                product_type_id INTEGER,
+                product_group_id INTEGER,
                 product_detail TEXT,
-                color TEXT,
-                brand TEXT,
+                color_id INTEGER,
+                brand_id INTEGER,
                 product_size TEXT,
-                room_type TEXT,
+                room_type_id INTEGER,
                 install_point TEXT,
                 install_size TEXT,
-                supplier_name TEXT,
+                supplier_name_id INTEGER,
                 po_number TEXT,
                 po_date TEXT,
                 install_confirm_date TEXT,
-                install_time_slot TEXT,
+                install_time_slot_id INTEGER,
                 install_date TEXT,
                 delivery_date TEXT,
                 notes TEXT,
-                document_status TEXT,
-                install_status TEXT,
+                document_status_id INTEGER,
+                install_status_id INTEGER,
                 cost_total_ex_vat REAL,
                 cost_total_in_vat REAL,
                 sale_total_ex_vat REAL,
                 sale_total_in_vat REAL,
-                items_group TEXT,
+                items_group_id INTEGER,
                 sales_month INTEGER,
                 sales_year INTEGER,
-                building TEXT,
-                floor_level TEXT,
+                building_id INTEGER,
+                floor_level_id INTEGER,
+                row_hash TEXT,
                 sync_timestamp TEXT,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         """)
+    
+    def create_dimension_tables(self, cursor):
+        """Create the dim_ table of every DIMENSION_COLUMNS column
+        
+        Full reloads share them with the live table, so keys stay stable and
+        the shadow table only adds values.
+        """
+        for column in DIMENSION_COLUMNS:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS dim_{column} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+    
+    def create_data_view(self, cursor):
+        """Create the dashboard_data view: every dashboard_rows column, each dimension key followed by its value
+        
+        The lookups are LEFT JOINs on primary keys, which SQLite leaves out of
+        any query that does not read the value.
+        """
+        columns = []
+        joins = []
+        cursor.execute("PRAGMA table_info(dashboard_rows)")
+        for _, name, _, _, _, _ in cursor.fetchall():
+            columns.append(f"dashboard_rows.{name}")
+            dimension = name.removesuffix('_id')
+            if dimension in DIMENSION_COLUMNS:
+                columns.append(f"dim_{dimension}.value AS {dimension}")
+                joins.append(f"LEFT JOIN dim_{dimension} ON dim_{dimension}.id = dashboard_rows.{name}")
+        cursor.execute(f"CREATE VIEW dashboard_data AS SELECT {', '.join(columns)} FROM dashboard_rows {' '.join(joins)}")
+    
+    def prune_dimensions(self, cursor):
+        """Delete dimension values that no row refers to any more"""
+        for column in DIMENSION_COLUMNS:
+            cursor.execute(f"DELETE FROM dim_{column} WHERE id NOT IN (SELECT {column}_id FROM dashboard_rows)")
+    
+    def ensure_indexes(self, cursor, table):
+        """Bring the indexes on table in line with INDEXES
+        
+        SQLite cannot rename indexes, so every index gets a unique suffix; that
+        way the shadow table's indexes never collide with the live ones. Indexes
+        whose definition changed or that are no longer listed are dropped.
+        """
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))
+        existing = {}
+        for index_name, sql in cursor.fetchall():
+            existing[index_name.rsplit('_', 1)[0]] = (index_name, sql[sql.rindex('('):])
+        
+        tag = secrets.token_hex(4)
+        for name, (unique, columns) in INDEXES.items():
+            current = existing.pop(f"idx_{name}", None)
+            if current and current[1] == f"({columns})":
+                continue
+            if current:
+                cursor.execute(f"DROP INDEX {current[0]}")
+            print(f"Creating index idx_{name} on {table}...")
+            cursor.execute(f"CREATE {unique} INDEX idx_{name}_{tag} ON {table} ({columns})")
         
+        for index_name, _ in existing.values():
+            cursor.execute(f"DROP INDEX {index_name}")
+    
+    def create_search_table(self, cursor, table):
+        """Create the full-text index over SEARCH_COLUMNS
+        
+        The trigram tokenizer matches any substring of three or more
+        characters, which also works for Thai text that has no word breaks.
+        Only rowids are read back, so the content lives in dashboard_rows.
+        """
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE {table} USING fts5(
+                {', '.join(SEARCH_COLUMNS)},
+                content='dashboard_rows', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    
+    def create_search_triggers(self, cursor):
+        """Keep the search index in step with row changes made by incremental syncs"""
+        columns = ', '.join(SEARCH_COLUMNS)
+        new_values = ', '.join(f'new.{c}' for c in SEARCH_COLUMNS)
+        old_values = ', '.join(f'old.{c}' for c in SEARCH_COLUMNS)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON dashboard_rows BEGIN
+                INSERT INTO {SEARCH_TABLE} (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON dashboard_rows BEGIN
+                INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF {columns} ON dashboard_rows
+            WHEN {' OR '.join(f'old.{c} IS NOT new.{c}' for c in SEARCH_COLUMNS)} BEGIN
+                INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {SEARCH_TABLE} (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        """)
+    
+    def analyze(self):
+        """Refresh the planner statistics for dashboard_rows"""
+        conn = self.connect()
+        # Sample a bounded number of rows per index so ANALYZE stays cheap on large tables
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE dashboard_rows")
         conn.commit()
         conn.close()
-        print("Database created successfully!")
     
-    def fetch_tsv_data(self):
-        """Fetch TSV data from Google Sheets"""
-        print("Fetching TSV data...")
+    def source_state(self):
+        """Validators and content hash of the last applied download of each sheet, keyed 'source_etag:<name>' etc."""
+        if not os.path.exists(self.db_path):
+            return {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return dict(conn.execute("SELECT key, value FROM sync_meta WHERE key LIKE 'source_%'").fetchall())
+        except sqlite3.Error:
+            return {}
+        finally:
+            conn.close()
+    
+    def save_source_state(self, snapshots):
+        """Remember what was applied so the next run can send conditional requests"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        self.create_meta_tables(cursor)
+        for snapshot in snapshots:
+            cursor.executemany("INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)", [
+                (f'source_etag:{snapshot.name}', snapshot.etag or ''),
+                (f'source_last_modified:{snapshot.name}', snapshot.last_modified or ''),
+                (f'source_hash:{snapshot.name}', snapshot.content_hash),
+            ])
+        conn.commit()
+        conn.close()
+    
+    def download_source(self, source, conditional=True):
+        """Download one sheet export to a temporary file; returns None if it has not changed
+        
+        With conditional=True the stored ETag/Last-Modified are sent so an
+        unchanged sheet costs a 304, and a download whose content hash matches
+        the last applied one is also reported as unchanged. Transient failures
+        are retried with exponential backoff; when the server supports ranges
+        the retry resumes after the bytes already received.
+        """
+        print(f"[{source.name}] Fetching TSV data...")
+        state = self.source_state() if conditional else {}
+        etag_key, last_modified_key, hash_key = (f'{key}:{source.name}' for key in ('source_etag', 'source_last_modified', 'source_hash'))
+        spool = tempfile.TemporaryFile(prefix="dashboard-sync-", suffix=".tsv")
+        hasher = hashlib.blake2b(digest_size=16)
+        received = 0
+        etag = last_modified = None
+        attempt = 0
+        
+        try:
+            while True:
+                headers = {'User-Agent': FETCH_USER_AGENT}
+                if received:
+                    headers['Range'] = f'bytes={received}-'
+                    # The server sends the whole file instead if it changed since the first attempt
+                    if etag or last_modified:
+                        headers['If-Range'] = etag or last_modified
+                else:
+                    if state.get(etag_key):
+                        headers['If-None-Match'] = state[etag_key]
+                    if state.get(last_modified_key):
+                        headers['If-Modified-Since'] = state[last_modified_key]
+                
+                retry_after = None
+                try:
+                    with urllib.request.urlopen(urllib.request.Request(source.url, headers=headers),
+                                                timeout=self.fetch_timeout) as response:
+                        if received and not self.resumes_at(response, received):
+                            print(f"[{source.name}] Server did not resume the download, starting over")
+                            spool.seek(0)
+                            spool.truncate()
+                            hasher = hashlib.blake2b(digest_size=16)
+                            received = 0
+                        if not received:
+                            etag = response.headers.get('ETag')
+                            last_modified = response.headers.get('Last-Modified')
+                        
+                        expected = response.headers.get('Content-Length')
+                        expected = received + int(expected) if expected else None
+                        while True:
+                            chunk = response.read(64 * 1024)
+                            if not chunk:
+                                break
+                            spool.write(chunk)
+                            hasher.update(chunk)
+                            received += len(chunk)
+                        if expected is not None and received < expected:
+                            raise http.client.IncompleteRead(b'', expected - received)
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code == 304:
+                        print(f"[{source.name}] Not modified since the last sync")
+                        spool.close()
+                        return None
+                    if e.code == 416:
+                        # Our partial copy no longer lines up with the file; fetch it whole
+                        spool.seek(0)
+                        spool.truncate()
+                        hasher = hashlib.blake2b(digest_size=16)
+                        received = 0
+                    elif e.code not in RETRY_STATUSES:
+                        raise
+                    retry_after = e.headers.get('Retry-After')
+                    error = e
+                except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                    error = e
+                
+                if attempt >= self.fetch_retries:
+                    raise error
+                attempt += 1
+                delay = min(2 ** attempt, 60) * random.uniform(0.5, 1.0)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, min(int(retry_after), 300))
+                print(f"[{source.name}] Fetch failed ({error}), retrying in {delay:.1f}s (attempt {attempt} of {self.fetch_retries})")
+                time.sleep(delay)
+        except BaseException:
+            spool.close()
+            raise
+        
+        content_hash = hasher.hexdigest()
+        print(f"[{source.name}] Fetched {received:,} bytes")
+        if conditional and content_hash == state.get(hash_key):
+            print(f"[{source.name}] Content unchanged since the last sync")
+            spool.close()
+            return None
+        return SourceSnapshot(source.name, spool, etag, last_modified, content_hash)
+    
+    def resumes_at(self, response, offset):
+        """Check that a ranged response continues exactly at offset"""
+        if response.status != 206:
+            return False
+        content_range = response.headers.get('Content-Range', '')
+        # "bytes START-END/TOTAL"
+        return content_range.startswith(f'bytes {offset}-')
+    
+    def fetch_tsv_data(self, source):
+        """Download one sheet unconditionally and yield its TSV rows"""
+        snapshot = self.download_source(source, conditional=False)
+        try:
+            yield from snapshot.rows()
+        finally:
+            snapshot.close()
+    
+    def read_sources(self, conditional=True):
+        """Fetch and parse every source in parallel, yielding parsed rows to the single writer
         
-        request = urllib.request.Request(
-            self.tsv_url,
-            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        )
+        Each worker downloads one sheet and parses it in batches onto a queue
+        holding at most 2 * fetch_workers batches, so downloads overlap one
+        another and the inserts. Once the rows
+        are exhausted, self.snapshots holds the downloads that changed,
+        self.source_timings the per-source fetch and parse times and
+        self.parse_reports the rows each parse rejected.
+        """
+        # Parsed batches, plus one None per finished source. It is unbounded so the completion callbacks, which may
+        # run on this (the only consuming) thread, never block; slots bounds the batches instead
+        batches = queue.SimpleQueue()
+        slots = threading.Semaphore(self.fetch_workers * 2)
+        cancelled = threading.Event()
+        self.snapshots = []
+        self.source_timings = {}
+        self.parse_reports = {}
         
-        with urllib.request.urlopen(request, timeout=30) as response:
-            data = response.read().decode('utf-8')
+        def ingest(source):
+            # The writer gave up before this sheet's turn came; don't download it
+            if cancelled.is_set():
+                return
+            timing = self.source_timings[source.name] = {"rows": 0}
+            started = time.perf_counter()
+            snapshot = self.download_source(source, conditional)
+            timing["fetch"] = time.perf_counter() - started
+            if snapshot is None:
+                return
+            lines = snapshot.rows()
+            try:
+                # Parse time leaves out waiting for the writer when the queue is full
+                timing["parse"] = 0.0
+                rows = self.parse_rows(lines, source, self.parse_reports.setdefault(source.name, ParseReport()))
+                while True:
+                    started = time.perf_counter()
+                    batch = list(itertools.islice(rows, self.batch_size))
+                    timing["parse"] += time.perf_counter() - started
+                    if not batch:
+                        break
+                    while not slots.acquire(timeout=0.1):
+                        if cancelled.is_set():
+                            return
+                    if cancelled.is_set():
+                        return
+                    batches.put(batch)
+                    timing["rows"] += len(batch)
+            finally:
+                lines.close()
+                snapshot.close()
+            if timing["rows"]:
+                self.snapshots.append(snapshot)
+            else:
+                print(f"[{source.name}] No rows received, leaving its existing rows untouched")
         
-        lines = data.strip().split('\n')
-        print(f"Fetched {len(lines)} lines from TSV")
+        with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(self.sources))) as pool:
+            futures = [pool.submit(ingest, source) for source in self.sources]
+            for future in futures:
+                future.add_done_callback(lambda _: batches.put(None))
+            try:
+                remaining = len(futures)
+                while remaining:
+                    batch = batches.get()
+                    if batch is None:
+                        remaining -= 1
+                    else:
+                        slots.release()
+                        yield from batch
+                # Any worker failure fails the whole sync
+                for future in futures:
+                    future.result()
+            finally:
+                # If the writer stopped early, skip the sheets not yet started; running workers
+                # notice within 0.1s, and the pool waits for them on exit
+                cancelled.set()
+                for future in futures:
+                    future.cancel()
         
-        return lines
+        for name, timing in self.source_timings.items():
+            if "parse" in timing:
+                print(f"[{name}] {timing['rows']:,} rows: fetch {timing['fetch']:.2f}s, parse {timing['parse']:.2f}s")
+            else:
+                print(f"[{name}] unchanged: fetch {timing['fetch']:.2f}s")
+            for phase in ("fetch", "parse"):
+                self.phase_timings[phase] = self.phase_timings.get(phase, 0.0) + timing.get(phase, 0.0)
     
-    def parse_and_insert_data(self, lines):
-        """Parse TSV data and insert into SQLite"""
-        print("Parsing and inserting data...")
+    def parse_rows(self, rows, source, report=None):
+        """Parse one sheet's TSV rows into tuples ordered like DATA_COLUMNS
         
-        if len(lines) < 2:
-            print("No data to insert")
-            return
+        Rejected rows and unreadable cells are counted in report (a ParseReport)
+        and summarized once the sheet is done.
+        """
+        if report is None:
+            report = ParseReport()
+        rows = iter(rows)
         
         # Parse header
-        header = lines[0].split('\t')
-        print(f"Found {len(header)} columns")
+        header = next(rows, None)
+        if header is None:
+            return
+        print(f"[{source.name}] Found {len(header)} columns")
         
-        # Connect to database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Resolve the column mapping once instead of per row
+        positions = list(source.positions(header).values())
+        unmapped = [i for i, position in enumerate(positions) if position is None]
+        positions = [position or 0 for position in positions]
+        width = max(positions) + 1
+        padding = [''] * width
+        pick = operator.itemgetter(*positions)
+        fields = list(SOURCE_COLUMNS)
+        # (position, column, converter) of every typed field, resolved once per sheet
+        converters = ([(fields.index(c), c, parse_int) for c in INT_COLUMNS]
+                      + [(fields.index(c), c, parse_float) for c in FLOAT_COLUMNS])
+        date_positions = [(fields.index(c), c) for c in DATE_COLUMNS]
+        order_date_position = fields.index('order_date')
         
-        inserted_count = 0
         sync_timestamp = datetime.now().isoformat()
+        line_numbers = {}
+        # Sheet date text -> YYYY-MM-DD (None if unreadable); a sheet has far fewer distinct dates than date cells
+        iso_dates = {}
         
-        # Process each data row
-        for i, line in enumerate(lines[1:], 1):
+        # Process each data row; the header is sheet line 1
+        for line_number, row_data in enumerate(rows, 2):
             try:
-                row_data = line.split('\t')
-                
                 # Ensure we have enough columns
-                while len(row_data) < len(header):
-                    row_data.append('')
+                if len(row_data) < width:
+                    row_data = row_data + padding[len(row_data):]
                 
-                # Map to database columns (based on Thai column names from TSV)
-                # Column indices based on the TSV structure we saw
-                insert_data = {
-                    'order_number': row_data[0] if len(row_data) > 0 else '',
-                    'order_date': row_data[1] if len(row_data) > 1 else '',
-                    'payment_date': row_data[2] if len(row_data) > 2 else '',
-                    'project_code': row_data[6] if len(row_data) > 6 else '',
-                    'project_name': row_data[8] if len(row_data) > 8 else '',
-                    'unit_no': row_data[9] if len(row_data) > 9 else '',
-                    'house_number': row_data[10] if len(row_data) > 10 else '',
-                    'unit_status': row_data[11] if len(row_data) > 11 else '',
-                    'contact_name': row_data[13] if len(row_data) > 13 else '',
-                    'contact_phone': row_data[14] if len(row_data) > 14 else '',
-                    'product_type': row_data[18] if len(row_data) > 18 else '',
-                    'product_group': row_data[19] if len(row_data) > 19 else '',
-                    'product_detail': row_data[23] if len(row_data) > 23 else '',
-                    'color': row_data[24] if len(row_data) > 24 else '',
-                    'brand': row_data[25] if len(row_data) > 25 else '',
-                    'product_size': row_data[26] if len(row_data) > 26 else '',
-                    'room_type': row_data[27] if len(row_data) > 27 else '',
-                    'install_point': row_data[28] if len(row_data) > 28 else '',
-                    'install_size': row_data[29] if len(row_data) > 29 else '',
-                    'supplier_name': row_data[35] if len(row_data) > 35 else '',
-                    'po_number': row_data[36] if len(row_data) > 36 else '',
-                    'po_date': row_data[37] if len(row_data) > 37 else '',
-                    'install_confirm_date': row_data[41] if len(row_data) > 41 else '',
-                    'install_time_slot': row_data[42] if len(row_data) > 42 else '',
-                    'install_date': row_data[43] if len(row_data) > 43 else '',
-                    'delivery_date': row_data[44] if len(row_data) > 44 else '',
-                    'notes': row_data[45] if len(row_data) > 45 else '',
-                    'document_status': row_data[46] if len(row_data) > 46 else '',
-                    'install_status': row_data[47] if len(row_data) > 47 else '',
-                    'items_group': row_data[22] if len(row_data) > 22 else '',
-                    'sales_month': self.safe_int(row_data[53]) if len(row_data) > 53 else None,
-                    'sales_year': self.safe_int(row_data[54]) if len(row_data) > 54 else None,
-                    'building': row_data[55] if len(row_data) > 55 else '',
-                    'floor_level': row_data[56].rstrip('\r\n') if len(row_data) > 56 else '',
-                    'sync_timestamp': sync_timestamp
-                }
+                values = list(pick(row_data))
+                for pos in unmapped:
+                    values[pos] = ''
+                if not any(values):
+                    report.skipped += 1
+                    continue
                 
-                # Convert cost/sale values to float
-                insert_data['cost_total_ex_vat'] = self.safe_float(row_data[48]) if len(row_data) > 48 else None
-                insert_data['cost_total_in_vat'] = self.safe_float(row_data[49]) if len(row_data) > 49 else None
-                insert_data['sale_total_ex_vat'] = self.safe_float(row_data[50]) if len(row_data) > 50 else None
-                insert_data['sale_total_in_vat'] = self.safe_float(row_data[51]) if len(row_data) > 51 else None
+                # Content hash over the raw sheet values, excluding the order number identity
+                row_hash = hashlib.blake2b('\x1f'.join(values[1:]).encode('utf-8'), digest_size=16).hexdigest()
                 
-                # Insert into database
-                cursor.execute("""
-                    INSERT INTO dashboard_data (
-                        order_number, order_date, payment_date, project_code, project_name,
-                        unit_no, house_number, unit_status, contact_name, contact_phone,
-                        product_type, product_group, product_detail, color, brand,
-                        product_size, room_type, install_point, install_size, supplier_name,
-                        po_number, po_date, install_confirm_date, install_time_slot,
-                        install_date, delivery_date, notes, document_status, install_status,
-                        cost_total_ex_vat, cost_total_in_vat, sale_total_ex_vat, sale_total_in_vat,
-                        items_group, sales_month, sales_year, building, floor_level, sync_timestamp
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    insert_data['order_number'], insert_data['order_date'], insert_data['payment_date'],
-                    insert_data['project_code'], insert_data['project_name'], insert_data['unit_no'],
-                    insert_data['house_number'], insert_data['unit_status'], insert_data['contact_name'],
-                    insert_data['contact_phone'], insert_data['product_type'], insert_data['product_group'],
-                    insert_data['product_detail'], insert_data['color'], insert_data['brand'],
-                    insert_data['product_size'], insert_data['room_type'], insert_data['install_point'],
-                    insert_data['install_size'], insert_data['supplier_name'], insert_data['po_number'],
-                    insert_data['po_date'], insert_data['install_confirm_date'], insert_data['install_time_slot'],
-                    insert_data['install_date'], insert_data['delivery_date'], insert_data['notes'],
-                    insert_data['document_status'], insert_data['install_status'], insert_data['cost_total_ex_vat'],
-                    insert_data['cost_total_in_vat'], insert_data['sale_total_ex_vat'], insert_data['sale_total_in_vat'],
-                    insert_data['items_group'], insert_data['sales_month'], insert_data['sales_year'],
-                    insert_data['building'], insert_data['floor_level'], insert_data['sync_timestamp']
-                ))
+                for pos, column, convert in converters:
+                    text = values[pos]
+                    value = convert(text) if text else None
+                    if value is INVALID:
+                        report.invalid(column, line_number, text)
+                        value = None
+                    values[pos] = value
+                for pos, column in date_positions:
+                    text = values[pos]
+                    if not text:
+                        values[pos] = None
+                        continue
+                    try:
+                        value = iso_dates[text]
+                    except KeyError:
+                        value = iso_dates[text] = self.iso_date(text)
+                    if value is None and not text.isspace():
+                        report.invalid(column, line_number, text)
+                    values[pos] = value
+                if values[order_date_position] is None:
+                    values[order_date_position] = ''
                 
-                inserted_count += 1
+                # Line identity: position of this line among the rows sharing its order number
+                order_number = values[0]
+                line_no = line_numbers.get(order_number, 0) + 1
+                line_numbers[order_number] = line_no
                 
-                if inserted_count % 1000 == 0:
-                    print(f"Inserted {inserted_count} rows...")
-                    
+                values.extend((source.name, line_no, row_hash, sync_timestamp))
+                yield values
+            
             except Exception as e:
-                print(f"Error processing row {i}: {e}")
+                report.reject(f"error: {type(e).__name__}", line_number)
                 continue
         
+        if report.skipped:
+            print(f"[{source.name}] Skipped {report.skipped:,} blank rows")
+        for cause, entry in report.rejected.items():
+            print(f"[{source.name}] Rejected {entry['rows']:,} rows ({cause}), e.g. lines {', '.join(map(str, entry['lines']))}")
+        for column, entry in report.invalid_values.items():
+            examples = ', '.join(f"{line} ({text!r})" for line, text in zip(entry['lines'], entry['values']))
+            print(f"[{source.name}] {entry['rows']:,} unreadable {column} values stored as NULL, e.g. lines {examples}")
+    
+    def insert_sql(self, table):
+        """INSERT statement covering every synced column"""
+        placeholders = ', '.join('?' for _ in ROW_COLUMNS)
+        return f"INSERT INTO {table} ({', '.join(ROW_COLUMNS)}) VALUES ({placeholders})"
+    
+    def dimension_lookups(self, cursor):
+        """(row position, column, value -> key) for every dimension column, as encode_dimensions() takes them"""
+        lookups = []
+        for column in DIMENSION_COLUMNS:
+            cursor.execute(f"SELECT value, id FROM dim_{column}")
+            lookups.append((DATA_COLUMNS.index(column), column, dict(cursor.fetchall())))
+        return lookups
+    
+    def encode_dimensions(self, cursor, lookups, rows):
+        """Replace the dimension values of parsed rows with their dim_ keys, adding values not seen before"""
+        for values in rows:
+            for position, column, keys in lookups:
+                key = keys.get(values[position])
+                if key is None:
+                    cursor.execute(f"INSERT INTO dim_{column} (value) VALUES (?)", (values[position],))
+                    key = keys[values[position]] = cursor.lastrowid
+                values[position] = key
+            yield values
+    
+    def insert_batches(self, cursor, table, rows):
+        """Encode and insert parsed rows with one executemany() call per batch; returns the row count"""
+        insert_sql = self.insert_sql(table)
+        inserted_count = 0
+        with self.timed_phase("write"):
+            lookups = self.dimension_lookups(cursor)
+        rows = iter(rows)
+        
+        while True:
+            # Waiting for the fetch and parse workers is not write time
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            with self.timed_phase("write"):
+                # Encoded in full first: new dimension values are inserted through the same cursor
+                cursor.executemany(insert_sql, list(self.encode_dimensions(cursor, lookups, batch)))
+            inserted_count += len(batch)
+            print(f"Inserted {inserted_count} rows...")
+        
+        return inserted_count
+    
+    def parse_and_insert_data(self, rows):
+        """Insert parsed rows into the shadow table"""
+        print("Parsing and inserting data...")
+        
+        # Connect to database
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            inserted_count = self.insert_batches(cursor, SHADOW_TABLE, rows)
+            if inserted_count == 0:
+                print("No data to insert")
+                return False
+            
+            # Indexes are cheaper to build once the rows are in place
+            with self.timed_phase("index"):
+                self.ensure_indexes(cursor, SHADOW_TABLE)
+                
+                print("Building search index...")
+                cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_SHADOW_TABLE}")
+                self.create_search_table(cursor, SEARCH_SHADOW_TABLE)
+                cursor.execute(f"""
+                    INSERT INTO {SEARCH_SHADOW_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)})
+                    SELECT id, {', '.join(SEARCH_COLUMNS)} FROM {SHADOW_TABLE}
+                """)
+            
+            with self.timed_phase("write"):
+                conn.commit()
+        finally:
+            conn.close()
+        
+        self.sync_counts = {"inserted": inserted_count, "updated": 0, "deleted": 0, "unchanged": 0}
+        print(f"Successfully inserted {inserted_count} rows into database")
+        return True
+    
+    def swap_shadow(self):
+        """Atomically replace dashboard_rows with the fully built shadow table
+        
+        Readers keep seeing the previous snapshot until the swap commits; if
+        anything fails the transaction is rolled back and the old table stays live.
+        """
+        print("Swapping in new snapshot...")
+        
+        conn = self.connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        
+        try:
+            with self.timed_phase("index"):
+                cursor.execute("BEGIN IMMEDIATE")
+                # The view goes first so the rename below has nothing referring to the old table;
+                # databases from before schema 7 have a dashboard_data table instead
+                cursor.execute("SELECT type FROM sqlite_master WHERE name = 'dashboard_data'")
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute(f"DROP {row[0].upper()} dashboard_data")
+                # Dropping the live table also drops its search triggers
+                cursor.execute("DROP TABLE IF EXISTS dashboard_rows")
+                cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+                cursor.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO dashboard_rows")
+                cursor.execute(f"ALTER TABLE {SEARCH_SHADOW_TABLE} RENAME TO {SEARCH_TABLE}")
+                self.create_data_view(cursor)
+                self.create_search_triggers(cursor)
+                self.prune_dimensions(cursor)
+                cursor.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+            with self.timed_phase("stats"):
+                self.refresh_summaries(cursor)
+                self.rebuild_cubes(cursor)
+            with self.timed_phase("write"):
+                self.bump_generation(cursor)
+                cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_SHADOW_TABLE}")
+            raise
+        finally:
+            conn.close()
+        
+        print("New snapshot is live")
+    
+    def refresh_summaries(self, cursor):
+        """Rebuild the summary tables from dashboard_rows within the caller's transaction"""
+        for table, (columns, query) in SUMMARY_TABLES.items():
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"INSERT INTO {table} {query}")
+    
+    def create_cube_tables(self, cursor):
+        """Create the revenue cubes, each indexed by partition for refreshes and year/month filters"""
+        for table, dimensions in CUBES.items():
+            columns = [f"{c} {'INTEGER' if c in CUBE_PARTITION else 'TEXT'}" for c in dimensions]
+            columns += ["record_count INTEGER"] + [f"{c} REAL" for c in FLOAT_COLUMNS]
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)})")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_partition ON {table} ({', '.join(CUBE_PARTITION)})")
+    
+    def partition_match(self, alias):
+        """Condition matching rows of alias to the temp.sync_touched partition t"""
+        return ' AND '.join(f'{alias}.{c} IS t.{c}' for c in CUBE_PARTITION)
+    
+    def cube_queries(self, touched_only=False):
+        """INSERT for every cube, in CUBES order, optionally limited to the partitions in temp.sync_touched"""
+        base = next(iter(CUBES))
+        for table, dimensions in CUBES.items():
+            if table == base:
+                # Group dashboard_rows on the dimension keys and look up the names once per group
+                columns = ', '.join(f'd.{c}_id' if c in DIMENSION_COLUMNS else f'd.{c}' for c in dimensions)
+                totals = ', '.join(['COUNT(*) AS record_count'] + [f'TOTAL(d.{c}) AS {c}' for c in FLOAT_COLUMNS])
+                names, joins = dimension_names('g', dimensions)
+                rows = "dashboard_rows AS d"
+            else:
+                columns = ', '.join(f'd.{c}' for c in dimensions)
+                totals = ', '.join(['SUM(d.record_count)'] + [f'TOTAL(d.{c})' for c in FLOAT_COLUMNS])
+                rows = f"{base} AS d"
+            if touched_only:
+                rows = f"temp.sync_touched AS t JOIN {rows} ON {self.partition_match('d')}"
+            grouped = f"SELECT {columns}, {totals} FROM {rows} GROUP BY {columns}"
+            if table == base:
+                figures = ', '.join(['g.record_count'] + [f'g.{c}' for c in FLOAT_COLUMNS])
+                yield table, f"INSERT INTO {table} SELECT {', '.join(names)}, {figures} FROM ({grouped}) AS g{joins}"
+            else:
+                yield table, f"INSERT INTO {table} {grouped}"
+    
+    def rebuild_cubes(self, cursor):
+        """Rebuild every revenue cube from dashboard_rows within the caller's transaction"""
+        self.create_cube_tables(cursor)
+        for table, insert_sql in self.cube_queries():
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(insert_sql)
+    
+    def refresh_cube_partitions(self, cursor):
+        """Recompute the cube rows of the partitions listed in temp.sync_touched"""
+        self.create_cube_tables(cursor)
+        for table, insert_sql in self.cube_queries(touched_only=True):
+            cursor.execute(f"""
+                DELETE FROM {table}
+                WHERE EXISTS (SELECT 1 FROM temp.sync_touched AS t WHERE {self.partition_match(table)})
+            """)
+            cursor.execute(insert_sql)
+    
+    def current_generation(self, cursor):
+        """Return the sync generation of the live data (0 before the first sync)"""
+        cursor.execute("SELECT value FROM sync_meta WHERE key = 'generation'")
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+    
+    def bump_generation(self, cursor):
+        """Advance the generation marker readers use to detect new data"""
+        generation = self.current_generation(cursor) + 1
+        cursor.executemany("INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)", [
+            ('generation', str(generation)),
+            ('synced_at', datetime.now().isoformat()),
+        ])
+        return generation
+    
+    def apply_incremental(self, rows):
+        """Upsert new and changed rows and delete vanished ones in a single transaction
+        
+        Only rows of the sources present in rows are compared, so an unchanged
+        sheet keeps its rows as they are; rows of sources no longer configured
+        are deleted. Returns False when no rows arrived and nothing was applied.
+        """
+        print("Applying incremental changes...")
+        
+        conn = self.connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        
+        key_match = "i.source_id IS d.source_id AND i.order_number IS d.order_number AND i.line_no = d.line_no"
+        changed_columns = [c for c in ROW_COLUMNS if c not in ('source_id', 'order_number', 'line_no')]
+        # Live rows that the incoming rows replace: those of the loaded sources and of removed ones
+        configured = [source.name for source in self.sources]
+        configured_ids = f"SELECT id FROM dim_source WHERE value IN ({', '.join('?' for _ in configured)})"
+        in_scope = f"(d.source_id IN (SELECT DISTINCT source_id FROM sync_incoming) OR d.source_id NOT IN ({configured_ids}))"
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Stage the parsed sheet next to the live table
+            cursor.execute("DROP TABLE IF EXISTS temp.sync_incoming")
+            cursor.execute(f"CREATE TEMP TABLE sync_incoming AS SELECT {', '.join(ROW_COLUMNS)} FROM dashboard_rows WHERE 0")
+            incoming_count = self.insert_batches(cursor, "temp.sync_incoming", rows)
+            cursor.execute(f"SELECT 1 FROM dashboard_rows WHERE source_id NOT IN ({configured_ids}) LIMIT 1", configured)
+            removed_sources = cursor.fetchone() is not None
+            if incoming_count == 0 and not removed_sources:
+                # Either nothing changed or, more likely than a real wipe, a fetch problem
+                cursor.execute("ROLLBACK")
+                print("No new rows received, leaving existing rows untouched")
+                return False
+            with self.timed_phase("index"):
+                cursor.execute("CREATE UNIQUE INDEX temp.idx_sync_incoming_key ON sync_incoming (source_id, order_number, line_no)")
+                
+                # Pick up index changes without waiting for the next full reload
+                self.ensure_indexes(cursor, "dashboard_rows")
+            
+            # Cube partitions of every row about to be deleted, changed or inserted, before and after the change
+            with self.timed_phase("stats"):
+                cursor.execute("DROP TABLE IF EXISTS temp.sync_touched")
+                cursor.execute(f"""
+                    CREATE TEMP TABLE sync_touched AS
+                    SELECT {', '.join(f'd.{c}' for c in CUBE_PARTITION)} FROM dashboard_rows AS d
+                    WHERE {in_scope}
+                    AND NOT EXISTS (SELECT 1 FROM sync_incoming AS i WHERE {key_match} AND i.row_hash IS d.row_hash)
+                    UNION
+                    SELECT {', '.join(f'i.{c}' for c in CUBE_PARTITION)} FROM sync_incoming AS i
+                    WHERE NOT EXISTS (SELECT 1 FROM dashboard_rows AS d WHERE {key_match} AND i.row_hash IS d.row_hash)
+                """, configured)
+            
+            with self.timed_phase("write"):
+                # Rows that disappeared from the sheet
+                cursor.execute(f"""
+                    DELETE FROM dashboard_rows AS d
+                    WHERE {in_scope}
+                    AND NOT EXISTS (SELECT 1 FROM sync_incoming AS i WHERE {key_match})
+                """, configured)
+                deleted = cursor.rowcount
+                
+                # Rows whose content hash changed
+                cursor.execute(f"""
+                    UPDATE dashboard_rows AS d
+                    SET {', '.join(f'{c} = i.{c}' for c in changed_columns)}
+                    FROM sync_incoming AS i
+                    WHERE {key_match} AND i.row_hash IS NOT d.row_hash
+                """)
+                updated = cursor.rowcount
+                
+                # Rows that are new to the table
+                cursor.execute(f"""
+                    INSERT INTO dashboard_rows ({', '.join(ROW_COLUMNS)})
+                    SELECT {', '.join(f'i.{c}' for c in ROW_COLUMNS)}
+                    FROM sync_incoming AS i
+                    WHERE NOT EXISTS (SELECT 1 FROM dashboard_rows AS d WHERE {key_match})
+                """)
+                inserted = cursor.rowcount
+                
+                cursor.execute("DROP TABLE temp.sync_incoming")
+            if inserted or updated or deleted:
+                with self.timed_phase("stats"):
+                    self.refresh_summaries(cursor)
+                    self.refresh_cube_partitions(cursor)
+                cursor.execute("SELECT COUNT(*) FROM temp.sync_touched")
+                print(f"Refreshed {cursor.fetchone()[0]} revenue cube partitions")
+                self.bump_generation(cursor)
+            cursor.execute("DROP TABLE temp.sync_touched")
+            with self.timed_phase("write"):
+                cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        
+        self.sync_counts = {
+            "inserted": inserted,
+            "updated": updated,
+            "deleted": deleted,
+            "unchanged": incoming_count - inserted - updated
+        }
+        print(f"Inserted {inserted:,}, updated {updated:,}, deleted {deleted:,}, unchanged {self.sync_counts['unchanged']:,} rows")
+        return True
+    
+    def sync_report(self, start_time, mode, seconds):
+        """Phase timings, row counts and rejected rows of the run, as recorded by record_sync_run()"""
+        rows_received = sum(timing["rows"] for timing in self.source_timings.values())
+        rejected = {}
+        skipped = 0
+        sources = {}
+        for name, timing in self.source_timings.items():
+            parse_report = self.parse_reports.get(name) or ParseReport()
+            for cause, entry in parse_report.rejected.items():
+                rejected[cause] = rejected.get(cause, 0) + entry["rows"]
+            skipped += parse_report.skipped
+            sources[name] = {key: round(value, 4) if isinstance(value, float) else value for key, value in timing.items()}
+            sources[name].update(rejected=parse_report.rejected, skipped=parse_report.skipped,
+                                 invalid_values=parse_report.invalid_values)
+        
+        return {
+            "started_at": start_time.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "mode": mode,
+            "seconds": round(seconds, 4),
+            "phases": {phase: round(self.phase_timings.get(phase, 0.0), 4) for phase in SYNC_PHASES},
+            "rows": dict(self.sync_counts, received=rows_received, rejected=sum(rejected.values()), skipped=skipped),
+            "rows_per_second": round(rows_received / seconds, 1) if seconds else None,
+            "rejected": rejected,
+            "sources": sources,
+        }
+    
+    def record_sync_run(self, report):
+        """Store a sync report in sync_runs and write it to SYNC_REPORT_PATH"""
+        phases = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in report["phases"].items())
+        print(f"Phases: {phases}; {report['rows']['received']:,} rows received "
+              f"({report['rows_per_second'] or 0:,.0f}/s), {report['rows']['rejected']:,} rejected")
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        self.create_meta_tables(cursor)
+        columns = ('started_at', 'finished_at', 'mode', 'inserted', 'updated', 'deleted', 'unchanged') + tuple(
+            name for name, _ in SYNC_RUN_COLUMNS)
+        cursor.execute(f"INSERT INTO sync_runs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})", (
+            report['started_at'], report['finished_at'], report['mode'],
+            report['rows']['inserted'], report['rows']['updated'], report['rows']['deleted'], report['rows']['unchanged'],
+            *report['phases'].values(), report['seconds'], report['rows']['received'], report['rows_per_second'],
+            report['rows']['rejected'], json.dumps(report, ensure_ascii=False)
+        ))
         conn.commit()
         conn.close()
-        print(f"Successfully inserted {inserted_count} rows into database")
         
-    def safe_int(self, value):
-        """Safely convert to int"""
+        if not self.report_path:
+            return
+        # Replace the file in one step so readers never see half a report
         try:
-            return int(float(str(value).replace(',', ''))) if value and str(value).strip() else None
-        except (ValueError, TypeError):
-            return None
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.report_path)), prefix=".sync_report-")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            os.replace(temporary, self.report_path)
+        except OSError as e:
+            print(f"Could not write the sync report to {self.report_path}: {e}")
     
-    def safe_float(self, value):
-        """Safely convert to float"""
+    def iso_date(self, value):
+        """Normalize a sheet date (d/m/yyyy or yyyy-mm-dd, Buddhist-era years allowed) to YYYY-MM-DD"""
+        # Drop a trailing time of day
+        value = value.strip().partition(' ')[0]
         try:
-            return float(str(value).replace(',', '')) if value and str(value).strip() else None
-        except (ValueError, TypeError):
+            if '/' in value:
+                day, month, year = (int(part) for part in value.split('/'))
+            elif '-' in value:
+                year, month, day = (int(part) for part in value[:10].split('-'))
+            else:
+                return None
+            if year < 100:
+                year += 2000
+            elif year > 2400:
+                year -= 543
+            return date(year, month, day).isoformat()
+        except ValueError:
             return None
     
     def show_stats(self):
@@ -222,17 +1325,14 @@ class SQLiteDataSync:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT COUNT(*) FROM dashboard_data")
-        total_rows = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(DISTINCT project_code) FROM dashboard_data WHERE project_code != ''")
-        unique_projects = cursor.fetchone()[0]
+        # The summary tables were refreshed with the data
+        cursor.execute("SELECT total_records, unique_projects FROM summary_totals")
+        total_rows, unique_projects = cursor.fetchone()
         
-        cursor.execute("SELECT COUNT(DISTINCT install_status) FROM dashboard_data WHERE install_status != ''")
-        unique_statuses = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT install_status, COUNT(*) FROM dashboard_data WHERE install_status != '' GROUP BY install_status ORDER BY COUNT(*) DESC LIMIT 5")
-        top_statuses = cursor.fetchall()
+        cursor.execute("SELECT install_status, record_count FROM summary_status ORDER BY record_count DESC")
+        statuses = cursor.fetchall()
+        unique_statuses = len(statuses)
+        top_statuses = statuses[:5]
         
         print(f"\n=== Database Statistics ===")
         print(f"Total records: {total_rows:,}")
@@ -244,32 +1344,129 @@ class SQLiteDataSync:
         
         conn.close()
     
-    def run_sync(self):
-        """Run the complete sync process"""
+    def run_sync(self, incremental=True):
+        """Run the complete sync process; returns True if the live data changed"""
+        self.phase_timings = dict.fromkeys(SYNC_PHASES, 0.0)
+        self.sync_counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        self.source_timings = {}
+        self.parse_reports = {}
         start_time = datetime.now()
+        started = time.perf_counter()
         print(f"Starting data sync at {start_time}")
         
         try:
-            # Create database
-            self.create_database()
+            # Fall back to a full reload when the table is missing or has an older layout
+            if incremental and self.schema_version() != SCHEMA_VERSION:
+                print("Database schema is missing or outdated, running a full reload")
+                incremental = False
+            
+            # Sheets are fetched and parsed in parallel while the rows are written; a full reload
+            # always downloads, an incremental sync skips sheets that have not changed
+            if incremental:
+                # Upsert only what changed
+                loaded = self.apply_incremental(self.read_sources(conditional=True))
+                if not loaded:
+                    self.record_sync_run(self.sync_report(start_time, "unchanged", time.perf_counter() - started))
+                    print(f"\nNothing to sync, finished in {datetime.now() - start_time}")
+                    return False
+            else:
+                # Create database
+                self.create_database()
+                
+                # Parse and insert data into the shadow table, then swap it in
+                loaded = self.parse_and_insert_data(self.read_sources(conditional=False))
+                if loaded:
+                    self.swap_shadow()
             
-            # Fetch TSV data
-            lines = self.fetch_tsv_data()
+            # Only remember the downloads once applied, so a failed run is retried in full
+            if loaded:
+                self.save_source_state(self.snapshots)
             
-            # Parse and insert data
-            self.parse_and_insert_data(lines)
+            changed = bool(self.sync_counts['inserted'] or self.sync_counts['updated'] or self.sync_counts['deleted'])
+            
+            # Refresh planner statistics once the new data is live
+            if changed:
+                with self.timed_phase("stats"):
+                    self.analyze()
             
             # Show statistics
-            self.show_stats()
+            with self.timed_phase("stats"):
+                self.show_stats()
+            
+            self.record_sync_run(self.sync_report(start_time, "incremental" if incremental else "full",
+                                                  time.perf_counter() - started))
             
             end_time = datetime.now()
             duration = end_time - start_time
             print(f"\nSync completed successfully in {duration}")
-            
+            return changed
+        
         except Exception as e:
             print(f"Sync failed: {e}")
             raise
+    
+    def notify_api(self):
+        """Tell a running API that new data is live so it can notify /api/events clients"""
+        try:
+            with open(self.api_pidfile) as f:
+                pid = int(f.read().strip())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Could not read the API pidfile {self.api_pidfile}: {e}")
+            return
+        try:
+            os.kill(pid, signal.SIGUSR1)
+            print(f"Notified API process {pid}")
+        except OSError as e:
+            # The API also polls the generation, so the change still reaches clients
+            print(f"Could not signal API process {pid}: {e}")
+    
+    def run_daemon(self, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER):
+        """Poll the sheet until SIGTERM/SIGINT, applying and announcing every change
+        
+        A sync in progress is always allowed to finish before the daemon exits.
+        Consecutive failures back off exponentially, up to an hour.
+        """
+        stop = threading.Event()
+        
+        def request_stop(signum, frame):
+            print(f"Received signal {signum}, stopping after the current sync")
+            stop.set()
+        
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        print(f"Sync daemon started, polling every {interval:g}s (+/- {jitter:g}s)")
+        
+        failures = 0
+        while not stop.is_set():
+            try:
+                if self.run_sync(incremental=True):
+                    self.notify_api()
+                failures = 0
+            except Exception:
+                # run_sync has already reported the error
+                failures += 1
+            
+            delay = interval * 2 ** min(failures, 6) if failures else interval
+            delay = min(delay, max(interval, 3600)) + random.uniform(-jitter, jitter)
+            stop.wait(max(delay, 1.0))
+        
+        print("Sync daemon stopped")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the Google Sheets TSV export into SQLite")
+    parser.add_argument("--full", action="store_true", help="Drop and reload every row instead of applying changes")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if the database needs a sync before serving")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and poll the sheet for changes")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between polls in daemon mode")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER, help="Random +/- seconds added to each interval")
+    args = parser.parse_args()
+    
     sync = SQLiteDataSync()
-    sync.run_sync()
\ No newline at end of file
+    if args.check:
+        sys.exit(0 if sync.is_ready() else 1)
+    if args.daemon:
+        sync.run_daemon(args.interval, args.jitter)
+    elif sync.run_sync(incremental=not args.full):
+        sync.notify_api()
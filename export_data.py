@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Bulk export of dashboard_data as CSV or a compact columnar file
+
+Rows are read from one SQLite cursor in batches of ROW_GROUP_SIZE and written
+as they arrive, so memory stays bounded whatever the export size.
+
+The columnar format ("DCOL") is laid out like a minimal Parquet file:
+
+    b"DCOL1\\n"
+    row groups: one zlib-compressed chunk per column, in column order
+    footer: UTF-8 JSON {"columns": [[name, type], ...], "row_groups": [{"rows": n, "chunks": [[offset, length], ...]}]}
+    footer length (8 bytes, little-endian), then b"DCOL1\\n" again
+
+A chunk of n rows starts with n validity bytes (0 = NULL). "int" and "real"
+columns follow with n little-endian int64/float64 values. "text" columns are
+dictionary-encoded: a uint32 dictionary size, the uint32 byte lengths of the
+UTF-8 entries, the entries themselves, then one code per row (uint16 if the
+dictionary has fewer than 65536 entries, else uint32). ColumnarReader reads it back.
+
+simple_api.py serves exports at /api/export and caches each file on disk per
+sync version. Run this module directly to export without the API:
+
+    python3 export_data.py --format columnar --output installs.dcol "install_status=...&sales_year=2024"
+"""
+import argparse
+import array
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import parse_qs
+
+MAGIC = b"DCOL1\n"
+
+# Rows per fetchmany() call, and per row group in columnar files
+ROW_GROUP_SIZE = 10000
+
+# Columns not worth exporting: sync bookkeeping (dimension keys, named *_id, are skipped too)
+EXCLUDED_COLUMNS = ('row_hash', 'created_at')
+
+# format -> (Content-Type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', '.csv'),
+    'columnar': ('application/vnd.dashboard.columnar', '.dcol'),
+}
+
+# Exports are cached here per sync version; files of versions synced earlier are removed
+DEFAULT_EXPORT_DIR = os.getenv("API_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "dashboard-exports"))
+
+def export_columns(cursor):
+    """(name, type) of every exported dashboard_data column, type being int, real or text"""
+    cursor.execute("PRAGMA table_info(dashboard_data)")
+    columns = []
+    for _, name, declared, _, _, _ in cursor.fetchall():
+        if name in EXCLUDED_COLUMNS or name.endswith('_id'):
+            continue
+        declared = declared.upper()
+        columns.append((name, 'int' if 'INT' in declared else 'real' if 'REAL' in declared else 'text'))
+    return columns
+
+def little_endian(values):
+    """Bytes of an array in little-endian order"""
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def encode_chunk(kind, values):
+    """Encode one column of a row group"""
+    validity = bytes(value is not None for value in values)
+    if kind == 'int':
+        payload = little_endian(array.array('q', (value or 0 for value in values)))
+    elif kind == 'real':
+        payload = little_endian(array.array('d', (value or 0.0 for value in values)))
+    else:
+        codes_by_value = {}
+        codes = [codes_by_value.setdefault(value, len(codes_by_value)) for value in values]
+        entries = [('' if value is None else str(value)).encode('utf-8') for value in codes_by_value]
+        code_type = 'H' if len(entries) < 65536 else 'I'
+        payload = b''.join((
+            struct.pack('<I', len(entries)),
+            little_endian(array.array('I', map(len, entries))),
+            b''.join(entries),
+            little_endian(array.array(code_type, codes)),
+        ))
+    return zlib.compress(validity + payload, 6)
+
+def decode_chunk(kind, data, rows):
+    """Inverse of encode_chunk; returns the column's values as a list"""
+    data = zlib.decompress(data)
+    validity, payload = data[:rows], data[rows:]
+    if kind in ('int', 'real'):
+        values = array.array('q' if kind == 'int' else 'd')
+        values.frombytes(payload)
+        if sys.byteorder == 'big':
+            values.byteswap()
+    else:
+        (size,) = struct.unpack_from('<I', payload)
+        lengths = array.array('I')
+        lengths.frombytes(payload[4:4 + 4 * size])
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+        position = 4 + 4 * size
+        entries = []
+        for length in lengths:
+            entries.append(payload[position:position + length].decode('utf-8'))
+            position += length
+        codes = array.array('H' if size < 65536 else 'I')
+        codes.frombytes(payload[position:])
+        if sys.byteorder == 'big':
+            codes.byteswap()
+        values = [entries[code] for code in codes]
+    return [value if valid else None for value, valid in zip(values, validity)]
+
+class CsvWriter:
+    """Writes rows as RFC 4180 CSV with a header line; NULL becomes an empty field"""
+    
+    def __init__(self, out, columns):
+        self.out = out
+        self.write_rows([[name for name, _ in columns]])
+    
+    def write_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\r\n').writerows(rows)
+        self.out.write(buffer.getvalue().encode('utf-8'))
+    
+    def close(self):
+        pass
+
+class ColumnarWriter:
+    """Writes rows in the DCOL format, one row group per write_rows() call"""
+    
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+        self.row_groups = []
+        self.offset = len(MAGIC)
+        out.write(MAGIC)
+    
+    def write_rows(self, rows):
+        chunks = []
+        for (_, kind), values in zip(self.columns, zip(*rows)):
+            data = encode_chunk(kind, values)
+            self.out.write(data)
+            chunks.append([self.offset, len(data)])
+            self.offset += len(data)
+        self.row_groups.append({"rows": len(rows), "chunks": chunks})
+    
+    def close(self):
+        footer = json.dumps({"columns": self.columns, "row_groups": self.row_groups}, separators=(',', ':')).encode('utf-8')
+        self.out.write(footer + struct.pack('<Q', len(footer)) + MAGIC)
+
+class ColumnarReader:
+    """Reads a DCOL file written by ColumnarWriter"""
+    
+    def __init__(self, file):
+        self.file = file
+        file.seek(-(8 + len(MAGIC)), os.SEEK_END)
+        (footer_length,) = struct.unpack('<Q', file.read(8))
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a DCOL file")
+        file.seek(-(8 + len(MAGIC) + footer_length), os.SEEK_END)
+        footer = json.loads(file.read(footer_length))
+        self.columns = [tuple(column) for column in footer["columns"]]
+        self.row_groups = footer["row_groups"]
+    
+    def read_group(self, index):
+        """Column name -> list of values for one row group"""
+        group = self.row_groups[index]
+        values = {}
+        for (name, kind), (offset, length) in zip(self.columns, group["chunks"]):
+            self.file.seek(offset)
+            values[name] = decode_chunk(kind, self.file.read(length), group["rows"])
+        return values
+    
+    def rows(self):
+        """Yield every row as a tuple in column order"""
+        for index in range(len(self.row_groups)):
+            yield from zip(*self.read_group(index).values())
+
+class TeeFile:
+    """Writes the same bytes to several binary files"""
+    
+    def __init__(self, *files):
+        self.files = files
+    
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+
+def write_export(cursor, where_sql, params, export_format, out):
+    """Write the dashboard_data rows matching where_sql to out (a binary file); returns the row count"""
+    columns = export_columns(cursor)
+    writer = (ColumnarWriter if export_format == 'columnar' else CsvWriter)(out, columns)
+    cursor.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM dashboard_data{where_sql} ORDER BY id", params)
+    
+    count = 0
+    while True:
+        rows = cursor.fetchmany(ROW_GROUP_SIZE)
+        if not rows:
+            break
+        writer.write_rows(rows)
+        count += len(rows)
+    writer.close()
+    return count
+
+class ExportCache:
+    """Export files on disk, named by sync version and request
+    
+    The version is the tag simple_api.sync_version() builds from the sync
+    marker; files of versions synced earlier are removed once a newer one is
+    written.
+    """
+    
+    def __init__(self, directory=DEFAULT_EXPORT_DIR):
+        self.directory = directory
+    
+    def path(self, version, key, export_format):
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=12).hexdigest()
+        return os.path.join(self.directory, f"{version}-{digest}{EXPORT_FORMATS[export_format][1]}")
+    
+    def open(self, version, key, export_format):
+        """Open the cached export for read, or return None"""
+        try:
+            return open(self.path(version, key, export_format), 'rb')
+        except FileNotFoundError:
+            return None
+    
+    @contextmanager
+    def create(self, version, key, export_format):
+        """Yield a temporary file that becomes the cached export if the block completes"""
+        os.makedirs(self.directory, exist_ok=True)
+        target = self.path(version, key, export_format)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".export-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(temporary, target)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self.prune(version)
+    
+    @staticmethod
+    def synced_at_key(version):
+        """Order version tags by the sync time after the dot; tags without one sort first"""
+        micros = version.partition('.')[2]
+        return int(micros) if micros.isdigit() else 0
+    
+    def prune(self, version):
+        """Remove exports of versions synced before this one; open handles keep working
+        
+        Newer files are kept, so an export that finishes late on an older
+        snapshot cannot delete them. The tags on disk are compared, not
+        anything in memory, so this also holds across prefork workers.
+        """
+        newest = self.synced_at_key(version)
+        for path in glob.glob(os.path.join(self.directory, "*-*.*")):
+            other = os.path.basename(path).split('-', 1)[0]
+            if other != version and self.synced_at_key(other) <= newest:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+if __name__ == "__main__":
+    from simple_api import DEFAULT_DB_PATH, build_export_query
+    
+    parser = argparse.ArgumentParser(description="Export dashboard rows as CSV or columnar (DCOL) files")
+    parser.add_argument("query", nargs="?", default="",
+                        help="Filters in /api/search query-string form, e.g. 'building=A&building=B&sales_year=2024'")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", default="-", help="File to write (default: standard output)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to the SQLite database")
+    args = parser.parse_args()
+    
+    query_params = parse_qs(args.query)
+    query_params['format'] = [args.format]
+    export_format, where_sql, params = build_export_query(query_params)
+    
+    conn = sqlite3.connect(Path(args.db).resolve().as_uri() + "?mode=ro", uri=True)
+    started = time.perf_counter()
+    try:
+        # One read transaction, so the export is a consistent snapshot even if a sync commits meanwhile
+        conn.execute("BEGIN")
+        if args.output == "-":
+            count = write_export(conn.cursor(), where_sql, params, export_format, sys.stdout.buffer)
+        else:
+            with open(args.output, 'wb') as f:
+                count = write_export(conn.cursor(), where_sql, params, export_format, f)
+    finally:
+        conn.close()
+    print(f"Exported {count:,} rows in {time.perf_counter() - started:.2f}s", file=sys.stderr)
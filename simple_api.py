@@ -1,209 +1,1562 @@
 #!/usr/bin/env python3
 import sqlite3
 import json
+import os
+import queue
+import argparse
+import threading
+import time
+import bisect
+import signal
+import sys
+import select
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import datetime
+import base64
+import gzip
+import zlib
+import email.utils
+from collections import OrderedDict, deque
+from columnar_engine import ColumnarEngine, DIMENSIONS as AGGREGATE_DIMENSIONS, MEASURES as AGGREGATE_MEASURES
+from data_sync_sqlite import DIMENSION_COLUMNS, dimension_names
+from export_data import EXPORT_FORMATS, ExportCache, TeeFile, write_export
+
+DEFAULT_DB_PATH = os.getenv("DASHBOARD_DB_PATH", "dashboard.db")
+DEFAULT_WORKERS = int(os.getenv("API_WORKERS", "16"))
+DEFAULT_POOL_SIZE = int(os.getenv("API_DB_POOL_SIZE", "0")) or DEFAULT_WORKERS
+DEFAULT_SERVER_MODE = os.getenv("API_SERVER_MODE", "threaded")
+DEFAULT_CACHE_BYTES = int(os.getenv("API_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Requests slower than this are logged with their SQL (0 disables the slow-query log)
+DEFAULT_SLOW_REQUEST_MS = float(os.getenv("API_SLOW_REQUEST_MS", "0"))
+
+# The sync daemon sends SIGUSR1 to the pid in this file after every change
+DEFAULT_PIDFILE = os.getenv("API_PIDFILE", "/tmp/dashboard-api.pid")
+# /api/events re-checks the generation this often even without a signal; also the keep-alive period
+DEFAULT_EVENTS_POLL = float(os.getenv("API_EVENTS_POLL", "10"))
+DEFAULT_EVENTS_MAX_CLIENTS = int(os.getenv("API_EVENTS_MAX_CLIENTS", "500"))
+# Answer /api/aggregate from an in-memory columnar snapshot instead of SQLite
+DEFAULT_COLUMNAR = os.getenv("API_COLUMNAR", "0").lower() in ("1", "true", "yes")
+# Worker processes in prefork mode (0 = one per CPU available to the container)
+DEFAULT_PROCESSES = int(os.getenv("API_PROCESSES", "0"))
+# In prefork mode, serve each worker from its own in-memory copy of the database, rolled over after every sync
+DEFAULT_SNAPSHOT = os.getenv("API_SNAPSHOT", "0").lower() in ("1", "true", "yes")
+
+# Summary endpoints read rollups that data_sync_sqlite.py materializes at the end of each sync
+TOTALS_SQL = "SELECT total_records, unique_projects FROM summary_totals"
+STATUS_BREAKDOWN_SQL = "SELECT install_status, record_count FROM summary_status ORDER BY record_count DESC"
+MONTHLY_BREAKDOWN_SQL = "SELECT sales_year, sales_month, record_count FROM summary_monthly ORDER BY sales_year DESC, sales_month DESC LIMIT 12"
+TOP_BRANDS_SQL = "SELECT brand, record_count FROM summary_brands ORDER BY record_count DESC LIMIT 10"
+PROJECTS_SQL = "SELECT project_code, project_name, record_count, latest_install FROM summary_projects ORDER BY record_count DESC"
+STATUS_SUMMARY_SQL = "SELECT install_status, record_count, percentage FROM summary_status ORDER BY record_count DESC"
+
+# /api/data reads the dashboard_data view, which joins each dimension key of dashboard_rows
+# to its name; filters match the keys so the sync's indexes on them apply
+DATA_SELECT_SQL = """
+    SELECT order_number, order_date, project_code, project_name, unit_no, house_number,
+           contact_name, contact_phone, product_detail, brand, product_size,
+           install_date, install_status, document_status, building, floor_level,
+           items_group, room_type, install_point, color, sync_timestamp, id
+    FROM dashboard_data
+"""
+
+# JSON field names of the DATA_SELECT_SQL columns; the trailing id only feeds the cursor
+DATA_FIELDS = (
+    'order_number', 'order_date', 'project_code', 'project_name', 'unit_no', 'house_number',
+    'contact_name', 'contact_phone', 'product_detail', 'brand', 'product_size',
+    'install_date', 'install_status', 'document_status', 'building', 'floor_level',
+    'items_group', 'room_type', 'install_point', 'color', 'sync_timestamp'
+)
+DATA_ORDER_DATE = 1
+DATA_ID = len(DATA_FIELDS)
+
+# Rows pulled from the cursor per write while streaming /api/data
+DATA_FETCH_SIZE = 250
+
+# Every item of one room, served by the (project_code_id, unit_no) index
+ROOM_SQL = (DATA_SELECT_SQL + " WHERE project_code_id = (SELECT id FROM dim_project_code WHERE value = ?)"
+            " AND unit_no = ? ORDER BY order_date DESC, id DESC")
+
+# Exact-match filters accepted by /api/data
+DATA_FILTERS = ('project_code', 'install_status', 'brand', 'unit_no')
+
+# Filters accepted by /api/search; repeat a parameter to match any of several values
+SEARCH_FILTERS = ('project_code', 'install_status', 'brand', 'building', 'floor_level', 'room_type', 'items_group')
+SEARCH_INT_FILTERS = ('sales_year', 'sales_month')
+
+# Columns /api/search returns per-value counts for
+FACETS = ('building', 'floor_level', 'room_type', 'items_group', 'install_status', 'brand')
+
+# Text-searchable columns, indexed by the dashboard_search trigram table the sync builds
+SEARCH_TEXT_COLUMNS = ('product_detail', 'contact_name')
+
+# Trigrams need at least three characters; shorter terms fall back to a substring LIKE
+SEARCH_MIN_TERM_LENGTH = 3
+
+# Most dimensions one /api/aggregate request may group by, and most groups it returns
+AGGREGATE_MAX_GROUP_BY = 4
+AGGREGATE_MAX_GROUPS = 10000
+
+# Revenue cubes the sync maintains, smallest first; /api/revenue reads the first one that
+# holds every dimension a request groups or filters by
+REVENUE_CUBES = {
+    'cube_revenue_period': ('sales_year', 'sales_month'),
+    'cube_revenue_project': ('project_code', 'sales_year', 'sales_month'),
+    'cube_revenue_brand': ('brand', 'sales_year', 'sales_month'),
+    'cube_revenue_items_group': ('items_group', 'sales_year', 'sales_month'),
+    'cube_revenue_supplier': ('supplier_name', 'sales_year', 'sales_month'),
+    'cube_revenue': ('project_code', 'brand', 'items_group', 'supplier_name', 'sales_year', 'sales_month'),
+}
+REVENUE_DIMENSIONS = REVENUE_CUBES['cube_revenue']
+REVENUE_INT_DIMENSIONS = ('sales_year', 'sales_month')
+# Figures returned for each /api/revenue group, after its dimensions
+REVENUE_FIELDS = ('count',) + AGGREGATE_MEASURES + ('margin', 'margin_pct')
+
+class BadRequest(Exception):
+    """Raised for invalid query parameters; reported to the client as a 400"""
+
+def encode_cursor(order_date, row_id):
+    """Opaque keyset cursor pointing just past the given row"""
+    return base64.urlsafe_b64encode(json.dumps([order_date, row_id]).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; returns (order_date, id)"""
+    try:
+        order_date, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return str(order_date), int(row_id)
+    except (ValueError, TypeError):
+        raise BadRequest("Invalid cursor")
+
+def build_data_query(query_params):
+    """Build the /api/data query; returns (sql, params, limit, offset)
+    
+    Rows are sorted on the stable key (order_date DESC, id DESC). A ?cursor=
+    from a previous page seeks straight to the next row through the index, so
+    deep pages cost the same as the first; ?offset= is still honoured without one.
+    One extra row is fetched to tell whether another page follows.
+    """
+    # Build query with filters
+    where_conditions = []
+    params = []
+    
+    for column in DATA_FILTERS:
+        if column in query_params:
+            value = query_params[column][0].strip()
+            if value:
+                where_conditions.append(match_values(column, [value]))
+                params.append(value)
+    
+    limit, offset = apply_pagination(query_params, where_conditions, params)
+    
+    # Build final query
+    base_query = page_sql(where_conditions)
+    params.extend([limit + 1, offset])
+    
+    return base_query, params, limit, offset
+
+def apply_pagination(query_params, where_conditions, params):
+    """Read ?limit=, ?offset= and ?cursor=, adding the cursor condition; returns (limit, offset)"""
+    try:
+        limit = max(min(int(query_params.get('limit', [100])[0]), 1000), 1)  # Max 1000 records
+        offset = max(int(query_params.get('offset', [0])[0]), 0)    # Min 0
+    except (ValueError, IndexError):
+        limit = 100
+        offset = 0
+    
+    cursor = query_params.get('cursor', [''])[0].strip()
+    if cursor:
+        where_conditions.append("(order_date, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+        offset = 0
+    
+    return limit, offset
+
+def where_clause(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+def page_sql(conditions):
+    """One page of rows matching conditions, newest first; takes LIMIT and OFFSET parameters
+    
+    The filter, sort and offset run on dashboard_rows and its indexes alone;
+    only the rows of the page are then read through the dashboard_data view,
+    so skipped rows cost no dimension lookups.
+    """
+    return (DATA_SELECT_SQL + " WHERE id IN (SELECT id FROM dashboard_rows" + where_clause(conditions)
+            + " ORDER BY order_date DESC, id DESC LIMIT ? OFFSET ?) ORDER BY order_date DESC, id DESC")
+
+def match_values(column, values):
+    """Condition matching column to any of values, through the column's dim_ key if it has one
+    
+    A single value is compared with = so an index on (key, order_date) still
+    returns rows in order.
+    """
+    placeholders = ', '.join('?' for _ in values)
+    if column not in DIMENSION_COLUMNS:
+        return f"{column} IN ({placeholders})"
+    if len(values) == 1:
+        return f"{column}_id = (SELECT id FROM dim_{column} WHERE value = ?)"
+    return f"{column}_id IN (SELECT id FROM dim_{column} WHERE value IN ({placeholders}))"
+
+def query_values(query_params, name):
+    """Non-empty values of a query parameter that may be repeated"""
+    return [value.strip() for value in query_params.get(name, []) if value.strip()]
+
+def search_filters(query_params):
+    """Parse the /api/search filters; returns (shared_conditions, shared_params, facet_filters)
+    
+    facet_filters maps each filtered facet column to its (condition, values),
+    kept apart so the facet counts can leave out a facet's own filter.
+    """
+    shared_conditions = []
+    shared_params = []
+    facet_filters = {}
+    
+    for column in SEARCH_FILTERS:
+        values = query_values(query_params, column)
+        if values:
+            condition = match_values(column, values)
+            if column in FACETS:
+                facet_filters[column] = (condition, values)
+            else:
+                shared_conditions.append(condition)
+                shared_params.extend(values)
+    
+    for column in SEARCH_INT_FILTERS:
+        values = query_values(query_params, column)
+        if values:
+            try:
+                shared_params.extend(int(value) for value in values)
+            except ValueError:
+                raise BadRequest(f"{column} must be an integer")
+            shared_conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+    
+    # Install date range; the sync stores dates as YYYY-MM-DD
+    for name, comparison in (('install_from', '>='), ('install_to', '<=')):
+        value = query_params.get(name, [''])[0].strip()
+        if value:
+            try:
+                shared_params.append(datetime.date.fromisoformat(value).isoformat())
+            except ValueError:
+                raise BadRequest(f"{name} must be a YYYY-MM-DD date")
+            shared_conditions.append(f"install_date {comparison} ?")
+    
+    # ?q= searches every text column, ?product_detail= / ?contact_name= just one
+    match_terms = []
+    for name in ('q',) + SEARCH_TEXT_COLUMNS:
+        for term in query_values(query_params, name):
+            columns = SEARCH_TEXT_COLUMNS if name == 'q' else (name,)
+            if len(term) >= SEARCH_MIN_TERM_LENGTH:
+                phrase = '"' + term.replace('"', '""') + '"'
+                match_terms.append(phrase if name == 'q' else f"{name} : {phrase}")
+            else:
+                # Substring, like the trigram match, so a name is found by any part of it
+                pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                shared_conditions.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ")")
+                shared_params.extend(pattern for _ in columns)
+    if match_terms:
+        shared_conditions.append("id IN (SELECT rowid FROM dashboard_search WHERE dashboard_search MATCH ?)")
+        shared_params.append(" AND ".join(match_terms))
+    
+    return shared_conditions, shared_params, facet_filters
+
+def build_search_query(query_params):
+    """Build the /api/search queries; returns (page_sql, page_params, facets_sql, facets_params, limit, offset)
+    
+    Each facet is counted under every filter except its own, so a client can
+    still offer the other values of a facet it has already narrowed. The facet
+    query reads the rows matching the remaining filters once, into a
+    materialized CTE, and counts every facet from that in the same statement,
+    grouping on the dimension keys and looking up only the counted values' names.
+    """
+    shared_conditions, shared_params, facet_filters = search_filters(query_params)
+    
+    # Page of rows matching every filter
+    page_conditions = shared_conditions + [condition for condition, _ in facet_filters.values()]
+    page_params = shared_params + [value for _, values in facet_filters.values() for value in values]
+    limit, offset = apply_pagination(query_params, page_conditions, page_params)
+    page_params.extend([limit + 1, offset])
+    
+    # Total (facet NULL) followed by the counts of each facet
+    facets_params = list(shared_params)
+    branches = []
+    for facet in (None,) + FACETS:
+        conditions = []
+        for column, (condition, values) in facet_filters.items():
+            if column != facet:
+                conditions.append(condition)
+                facets_params.extend(values)
+        if facet is None:
+            branches.append(f"SELECT NULL, NULL, COUNT(*) FROM matched{where_clause(conditions)}")
+        else:
+            counts = f"SELECT {facet}_id, COUNT(*) AS n FROM matched{where_clause(conditions)} GROUP BY {facet}_id"
+            branches.append(f"SELECT '{facet}', value, n FROM ({counts}) JOIN dim_{facet} ON id = {facet}_id WHERE value != ''")
+    facets_sql = (f"WITH matched AS MATERIALIZED (SELECT {', '.join(f'{facet}_id' for facet in FACETS)} "
+                  f"FROM dashboard_rows{where_clause(shared_conditions)}) "
+                  + " UNION ALL ".join(branches) + " ORDER BY 1, 3 DESC, 2")
+    
+    return page_sql(page_conditions), page_params, facets_sql, facets_params, limit, offset
+
+def build_export_query(query_params):
+    """Build the /api/export filter from the /api/search filters; returns (format, where_sql, params)"""
+    export_format = query_params.get('format', ['csv'])[0]
+    if export_format not in EXPORT_FORMATS:
+        raise BadRequest(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    conditions, params, facet_filters = search_filters(query_params)
+    for condition, values in facet_filters.values():
+        conditions.append(condition)
+        params.extend(values)
+    where_sql = where_clause(conditions)
+    if where_sql:
+        # Match ids on dashboard_rows' indexes first; otherwise the planner may scan the whole table in id order to skip the sort
+        where_sql = f" WHERE id IN (SELECT id FROM dashboard_rows{where_sql})"
+    return export_format, where_sql, params
+
+# Request phases timed by RequestTimer, in the order they normally happen
+PHASES = ('connect', 'query', 'rows', 'serialize', 'write')
+
+# The SQLite progress handler fires every this many VM instructions
+VM_STEP_INTERVAL = 1000
+
+class RequestTimer:
+    """Splits one request's wall time into PHASES
+    
+    Exactly one phase is running at a time; switch() charges the time since
+    the previous switch to the phase that was running, so nested work (SQL run
+    while building a response) is never counted twice.
+    """
+    
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.current = None
+        self.started = self.mark = time.perf_counter()
+        self.total = None
+        self.rows = 0
+        self.vm_steps = 0
+        self.statements = []
+    
+    def switch(self, phase):
+        """Start charging time to phase; returns the phase that was running"""
+        now = time.perf_counter()
+        if self.current is not None:
+            self.phases[self.current] += now - self.mark
+        previous, self.current, self.mark = self.current, phase, now
+        return previous
+    
+    def stop(self):
+        self.switch(None)
+        self.total = self.mark - self.started
+    
+    def count_vm_steps(self):
+        # Progress handler; a non-zero return value would abort the query
+        self.vm_steps += VM_STEP_INTERVAL
+        return 0
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute() to the query phase and fetches to the rows phase"""
+    
+    timer = None
+    
+    def execute(self, sql, parameters=()):
+        previous = self.timer.switch('query')
+        started = self.timer.mark
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.timer.statements.append((sql, parameters, time.perf_counter() - started))
+            self.timer.switch(previous)
+    
+    def fetchone(self):
+        previous = self.timer.switch('rows')
+        row = super().fetchone()
+        self.timer.switch(previous)
+        if row is not None:
+            self.timer.rows += 1
+        return row
+    
+    def fetchmany(self, size=None):
+        previous = self.timer.switch('rows')
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.timer.switch(previous)
+        self.timer.rows += len(rows)
+        return rows
+    
+    def fetchall(self):
+        previous = self.timer.switch('rows')
+        rows = super().fetchall()
+        self.timer.switch(previous)
+        self.timer.rows += len(rows)
+        return rows
+
+class Histogram:
+    """Cumulative histogram in the Prometheus bucket layout"""
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestMetrics:
+    """Per-endpoint request metrics, rendered in the Prometheus text format
+    
+    Phase durations, rows fetched and SQLite VM steps are cumulative
+    histograms; total latency quantiles are computed over a rolling window of
+    the most recent requests.
+    """
+    
+    SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+    VM_STEP_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+    QUANTILES = (0.5, 0.95, 0.99)
+    
+    # Rolling window: at most this many requests per endpoint, none older than WINDOW_SECONDS
+    WINDOW_REQUESTS = 1024
+    WINDOW_SECONDS = 300
+    
+    def __init__(self):
+        self.requests = {}
+        self.phase_seconds = {}
+        self.request_seconds = {}
+        self.rows = {}
+        self.vm_steps = {}
+        self.recent = {}
+        self._lock = threading.Lock()
+    
+    def record(self, endpoint, status, timer):
+        with self._lock:
+            self.requests[endpoint, status] = self.requests.get((endpoint, status), 0) + 1
+            for phase, seconds in timer.phases.items():
+                self._histogram(self.phase_seconds, (endpoint, phase), self.SECONDS_BUCKETS).observe(seconds)
+            self._histogram(self.request_seconds, endpoint, self.SECONDS_BUCKETS).observe(timer.total)
+            self._histogram(self.rows, endpoint, self.ROWS_BUCKETS).observe(timer.rows)
+            self._histogram(self.vm_steps, endpoint, self.VM_STEP_BUCKETS).observe(timer.vm_steps)
+            window = self.recent.setdefault(endpoint, deque(maxlen=self.WINDOW_REQUESTS))
+            window.append((timer.mark, timer.total))
+    
+    def _histogram(self, family, key, buckets):
+        histogram = family.get(key)
+        if histogram is None:
+            histogram = family[key] = Histogram(buckets)
+        return histogram
+    
+    def render(self, response_cache=None, events=None):
+        """Return every metric as Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append("# HELP dashboard_api_requests_total Requests served, by endpoint and status code")
+            lines.append("# TYPE dashboard_api_requests_total counter")
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'dashboard_api_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            
+            self._render_histograms(lines, "dashboard_api_phase_seconds",
+                                    "Time spent per request in each phase (connect, query, rows, serialize, write)",
+                                    {('endpoint', 'phase'): self.phase_seconds})
+            self._render_histograms(lines, "dashboard_api_request_seconds", "Total request duration",
+                                    {('endpoint',): self.request_seconds})
+            self._render_histograms(lines, "dashboard_api_rows_fetched", "Rows fetched from SQLite per request",
+                                    {('endpoint',): self.rows})
+            self._render_histograms(lines, "dashboard_api_sqlite_vm_steps",
+                                    f"SQLite VM instructions per request, sampled every {VM_STEP_INTERVAL} (tracks rows scanned)",
+                                    {('endpoint',): self.vm_steps})
+            
+            lines.append(f"# HELP dashboard_api_recent_request_seconds Request duration quantiles over the last {self.WINDOW_SECONDS}s")
+            lines.append("# TYPE dashboard_api_recent_request_seconds summary")
+            cutoff = time.perf_counter() - self.WINDOW_SECONDS
+            for endpoint, window in sorted(self.recent.items()):
+                while window and window[0][0] < cutoff:
+                    window.popleft()
+                durations = sorted(duration for _, duration in window)
+                for quantile in self.QUANTILES:
+                    value = durations[min(len(durations) - 1, int(quantile * len(durations)))] if durations else float('nan')
+                    lines.append(f'dashboard_api_recent_request_seconds{{endpoint="{endpoint}",quantile="{quantile}"}} {value:.6f}')
+                lines.append(f'dashboard_api_recent_request_seconds_sum{{endpoint="{endpoint}"}} {sum(durations):.6f}')
+                lines.append(f'dashboard_api_recent_request_seconds_count{{endpoint="{endpoint}"}} {len(durations)}')
+        
+        if response_cache is not None:
+            lines.append("# HELP dashboard_api_cache_bytes Bytes held by the response cache")
+            lines.append("# TYPE dashboard_api_cache_bytes gauge")
+            lines.append(f"dashboard_api_cache_bytes {response_cache.size}")
+            lines.append("# HELP dashboard_api_cache_entries Responses held by the response cache")
+            lines.append("# TYPE dashboard_api_cache_entries gauge")
+            lines.append(f"dashboard_api_cache_entries {len(response_cache._entries)}")
+        if events is not None:
+            lines.append("# HELP dashboard_api_event_clients Open /api/events streams")
+            lines.append("# TYPE dashboard_api_event_clients gauge")
+            lines.append(f"dashboard_api_event_clients {events.client_count()}")
+        return "\n".join(lines) + "\n"
+    
+    def _render_histograms(self, lines, name, help_text, families):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_names, family in families.items():
+            for key, histogram in sorted(family.items()):
+                values = key if isinstance(key, tuple) else (key,)
+                labels = ",".join(f'{label}="{value}"' for label, value in zip(label_names, values))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+def requested_names(query_params, param, allowed):
+    """Names from a comma-separated or repeated parameter, each checked against allowed"""
+    requested = [name.strip() for value in query_params.get(param, []) for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise BadRequest(f"Unknown {param}: {', '.join(unknown)}; choose from {', '.join(allowed)}")
+    return tuple(dict.fromkeys(requested))
+
+def group_limit(query_params):
+    """Read ?limit= for the grouped endpoints, capped at AGGREGATE_MAX_GROUPS"""
+    try:
+        return max(min(int(query_params.get('limit', [AGGREGATE_MAX_GROUPS])[0]), AGGREGATE_MAX_GROUPS), 1)
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+
+def parse_aggregate_params(query_params):
+    """Read an /api/aggregate request; returns (group_by, filters, measures, limit)
+    
+    ?group_by= and ?measure= take comma-separated or repeated names; any
+    dimension given as a parameter filters on its (possibly repeated) values.
+    """
+    group_by = requested_names(query_params, 'group_by', AGGREGATE_DIMENSIONS)
+    if len(group_by) > AGGREGATE_MAX_GROUP_BY:
+        raise BadRequest(f"group_by accepts at most {AGGREGATE_MAX_GROUP_BY} dimensions")
+    measures = requested_names(query_params, 'measure', AGGREGATE_MEASURES)
+    filters = {name: tuple(query_values(query_params, name)) for name in AGGREGATE_DIMENSIONS
+               if query_values(query_params, name)}
+    return group_by, filters, measures, group_limit(query_params)
+
+def build_aggregate_query(group_by, filters, measures):
+    """SQL equivalent of ColumnarSnapshot.aggregate, used when the columnar engine is off
+    
+    Rows are grouped on the integer dimension keys; names are looked up once per group.
+    """
+    conditions = []
+    params = []
+    for name, values in filters.items():
+        conditions.append(match_values(name, values))
+        params.extend(values)
+    keys = [f"{name}_id" if name in DIMENSION_COLUMNS else name for name in group_by]
+    columns = keys + ["COUNT(*) AS record_count"] + [f"TOTAL({name}) AS {name}" for name in measures]
+    grouped = f"SELECT {', '.join(columns)} FROM dashboard_rows{where_clause(conditions)}"
+    if group_by:
+        grouped += f" GROUP BY {', '.join(keys)}"
+    names, joins = dimension_names('g', group_by)
+    figures = ["g.record_count"] + [f"g.{name}" for name in measures]
+    return f"SELECT {', '.join(names + figures)} FROM ({grouped}) AS g{joins}", params
+
+def build_revenue_query(query_params):
+    """Build the /api/revenue query; returns (sql, params, group_by, limit)
+    
+    Groups come back sorted by sales (ex VAT), largest first.
+    """
+    group_by = requested_names(query_params, 'group_by', REVENUE_DIMENSIONS)
+    filtered = [name for name in REVENUE_DIMENSIONS if query_values(query_params, name)]
+    cube = next(table for table, dimensions in REVENUE_CUBES.items()
+                if set(group_by).union(filtered) <= set(dimensions))
+    
+    conditions = []
+    params = []
+    for name in filtered:
+        values = query_values(query_params, name)
+        if name in REVENUE_INT_DIMENSIONS:
+            try:
+                values = [int(value) for value in values]
+            except ValueError:
+                raise BadRequest(f"{name} must be an integer")
+        conditions.append(f"{name} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+    
+    # Rounding and margins are computed in SQL so rows go to JSON as they are;
+    # the window sums carry the overall totals on every row
+    sales, cost = 'TOTAL(sale_total_ex_vat)', 'TOTAL(cost_total_ex_vat)'
+    columns = list(group_by) + ["SUM(record_count)"] + [f"ROUND(TOTAL({name}), 2)" for name in AGGREGATE_MEASURES]
+    columns += [f"ROUND({sales} - {cost}, 2)", f"ROUND(({sales} - {cost}) * 100 / NULLIF({sales}, 0), 2)"]
+    columns += ["SUM(SUM(record_count)) OVER ()"] + [f"TOTAL(TOTAL({name})) OVER ()" for name in AGGREGATE_MEASURES]
+    sql = f"SELECT {', '.join(columns)} FROM {cube}{where_clause(conditions)}"
+    if group_by:
+        sale_position = len(group_by) + 2 + AGGREGATE_MEASURES.index('sale_total_ex_vat')
+        sql += f" GROUP BY {', '.join(group_by)} ORDER BY {sale_position} DESC, {', '.join(group_by)}"
+    return sql, params, group_by, group_limit(query_params)
+
+def revenue_totals(count, sums):
+    """Count, rounded sums and ex-VAT margin over every /api/revenue group"""
+    amounts = dict(zip(AGGREGATE_MEASURES, sums))
+    margin = amounts['sale_total_ex_vat'] - amounts['cost_total_ex_vat']
+    totals = {"count": count or 0}
+    totals.update((name, round(value, 2)) for name, value in amounts.items())
+    totals["margin"] = round(margin, 2)
+    totals["margin_pct"] = round(margin * 100 / amounts['sale_total_ex_vat'], 2) if amounts['sale_total_ex_vat'] else None
+    return totals
+
+class ConnectionPool:
+    """Bounded pool of read-only SQLite connections reused across requests"""
+    
+    PRAGMAS = (
+        "PRAGMA query_only = ON",
+        "PRAGMA cache_size = -16000",
+        "PRAGMA mmap_size = 268435456",
+        "PRAGMA temp_store = MEMORY",
+    )
+    
+    def __init__(self, db_path, size=DEFAULT_POOL_SIZE, timeout=10.0, snapshot=False):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.enable_wal()
+        self.snapshot = self.load_snapshot() if snapshot else None
+    
+    def enable_wal(self):
+        """Switch the database to WAL so readers are never blocked by the sync writer"""
+        if not os.path.exists(self.db_path):
+            return
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not enable WAL mode on {self.db_path}: {e}")
+    
+    def load_snapshot(self):
+        """Copy the database into memory; pooled connections then read the copy
+        
+        The copy lives in the memdb VFS under a name starting with "/", which
+        every connection of this process shares. The returned connection keeps
+        it alive until close().
+        """
+        source = sqlite3.connect(Path(self.db_path).resolve().as_uri() + "?mode=ro", uri=True, timeout=self.timeout)
+        try:
+            image = bytearray(source.serialize())
+        finally:
+            source.close()
+        # memdb cannot open a database whose header says WAL (bytes 18-19); mark it as a rollback-journal one
+        image[18:20] = b'\x01\x01'
+        staging = sqlite3.connect(":memory:")
+        staging.deserialize(image)
+        del image
+        
+        # A deserialized database is private to its connection, so back it up into the shared one
+        self.snapshot_uri = f"file:/dashboard-snapshot-{os.getpid()}?vfs=memdb"
+        snapshot = sqlite3.connect(self.snapshot_uri, uri=True, check_same_thread=False)
+        try:
+            staging.backup(snapshot)
+        finally:
+            staging.close()
+        return snapshot
+    
+    def _connect(self):
+        if self.snapshot is not None:
+            uri = self.snapshot_uri
+        else:
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, returning it to the pool when the block exits"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise RuntimeError("Timed out waiting for a database connection")
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            yield conn
+        except sqlite3.DatabaseError:
+            # Drop connections that hit a database error instead of reusing them
+            if conn is not None:
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+            self._slots.release()
+    
+    def close(self):
+        """Close every idle connection, and the in-memory copy if there is one"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+class EventBroadcaster:
+    """Pushes a Server-Sent Event to every /api/events client when the sync generation changes
+    
+    Client sockets are owned by this one thread instead of a request worker
+    each, so open dashboards never tie up the worker pool. The thread wakes on
+    notify() (SIGUSR1 from the sync daemon) and at least every poll_interval,
+    which also keeps idle connections alive through proxies.
+    """
+    
+    SEND_TIMEOUT = 2.0
+    KEEP_ALIVE = b': keep-alive\n\n'
+    
+    def __init__(self, db_pool, poll_interval=DEFAULT_EVENTS_POLL, max_clients=DEFAULT_EVENTS_MAX_CLIENTS):
+        self.db_pool = db_pool
+        self.poll_interval = poll_interval
+        self.max_clients = max_clients
+        self.generation = None
+        self.clients = []
+        self.pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run, name="api-events", daemon=True)
+        self._thread.start()
+    
+    def has_room(self):
+        with self._lock:
+            return len(self.clients) + len(self.pending) < self.max_clients
+    
+    def add_client(self, sock):
+        """Take ownership of a client socket; it is sent the current generation right away"""
+        sock.settimeout(self.SEND_TIMEOUT)
+        with self._lock:
+            self.pending.append(sock)
+        self._wake.set()
+    
+    def notify(self):
+        """Re-check the generation now; safe to call from a signal handler"""
+        self._wake.set()
+    
+    def client_count(self):
+        with self._lock:
+            return len(self.clients) + len(self.pending)
+    
+    def run(self):
+        while not self._stopped:
+            woken = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            
+            message = None
+            try:
+                with self.db_pool.connection() as conn:
+                    generation, synced_at = read_sync_marker(conn.cursor())
+                changed = generation != self.generation
+                self.generation = generation
+                message = b'event: sync\ndata: ' + encode_json({
+                    "generation": generation,
+                    "synced_at": synced_at.isoformat() if synced_at else None
+                }) + b'\n\n'
+            except (sqlite3.Error, RuntimeError, KeyError, ValueError) as e:
+                print(f"Could not read the sync generation for /api/events: {e}")
+                changed = False
+            
+            with self._lock:
+                new_clients, self.pending = self.pending, []
+                clients = list(self.clients)
+            
+            # Existing clients hear about changes, or get a keep-alive when the wait timed out;
+            # new clients are told the current generation as soon as it is known
+            if changed:
+                payload = message
+            elif not woken:
+                payload = self.KEEP_ALIVE
+            else:
+                payload = None
+            dead = [sock for sock in clients if payload and not self.send(sock, payload)]
+            if message is None:
+                # Keep new clients waiting until the database can be read
+                with self._lock:
+                    self.pending.extend(new_clients)
+                new_clients = []
+            dead += [sock for sock in new_clients if not self.send(sock, message)]
+            
+            with self._lock:
+                self.clients = [sock for sock in self.clients if sock not in dead]
+                self.clients.extend(sock for sock in new_clients if sock not in dead)
+            for sock in dead:
+                sock.close()
+    
+    def send(self, sock, payload):
+        try:
+            sock.sendall(payload)
+            return True
+        except OSError:
+            return False
+    
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            for sock in self.clients + self.pending:
+                sock.close()
+            self.clients = []
+            self.pending = []
+
+class DashboardHTTPServer(HTTPServer):
+    """Single-threaded server that owns the shared connection pool, response cache and event stream"""
+    
+    def __init__(self, server_address, handler_class, db_path=DEFAULT_DB_PATH, pool_size=1,
+                 cache_bytes=DEFAULT_CACHE_BYTES, slow_request_ms=DEFAULT_SLOW_REQUEST_MS,
+                 columnar=DEFAULT_COLUMNAR, listen_socket=None, snapshot=False):
+        self.db_pool = ConnectionPool(db_path, pool_size, snapshot=snapshot)
+        self.response_cache = ResponseCache(cache_bytes)
+        self.metrics = RequestMetrics()
+        self.slow_request_ms = slow_request_ms
+        self.columnar = ColumnarEngine() if columnar else None
+        self.exports = ExportCache()
+        self.events = EventBroadcaster(self.db_pool)
+        self.detached = set()
+        if listen_socket is None:
+            super().__init__(server_address, handler_class)
+        else:
+            # Prefork worker: accept on the socket the supervisor bound for this worker's slot
+            super().__init__(server_address, handler_class, bind_and_activate=False)
+            self.socket.close()
+            self.socket = listen_socket
+            self.server_address = listen_socket.getsockname()
+            self.server_name, self.server_port = self.server_address[:2]
+    
+    def get_request(self):
+        request, client_address = super().get_request()
+        # Prefork listening sockets are non-blocking; connections themselves must block
+        request.setblocking(True)
+        return request, client_address
+    
+    def detach_request(self, request):
+        """Keep the connection open after the handler returns; its dup() now owns it"""
+        self.detached.add(request)
+    
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            # Only release this descriptor; shutdown() would also end the duplicated one
+            self.close_request(request)
+            return
+        super().shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.events.stop()
+        self.db_pool.close()
+
+class ThreadPoolHTTPServer(DashboardHTTPServer):
+    """Server that handles requests on a fixed number of worker threads"""
+    
+    request_queue_size = 128
+    
+    def __init__(self, server_address, handler_class, db_path=DEFAULT_DB_PATH,
+                 pool_size=DEFAULT_POOL_SIZE, workers=DEFAULT_WORKERS, cache_bytes=DEFAULT_CACHE_BYTES,
+                 slow_request_ms=DEFAULT_SLOW_REQUEST_MS, columnar=DEFAULT_COLUMNAR, listen_socket=None, snapshot=False):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        super().__init__(server_address, handler_class, db_path, pool_size, cache_bytes, slow_request_ms, columnar,
+                         listen_socket, snapshot)
+    
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_worker, request, client_address)
+    
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        self.executor.shutdown(wait=True)
+        super().server_close()
+
+class ResponseCache:
+    """LRU cache of encoded response bodies, bounded by total size
+    
+    Entries belong to one sync version (see sync_version); the whole cache is
+    dropped as soon as a request observes a newer version. Requests still
+    reading an older version bypass the cache, as in ColumnarEngine.get.
+    """
+    
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # No single response may take more than a quarter of the budget
+        self.max_entry_bytes = max_bytes // 4
+        self.version = None
+        self.synced_at = None
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _sync_version(self, version, synced_at):
+        """Switch to version unless it is older than the cached one; return whether the cache holds version"""
+        if version == self.version:
+            return True
+        if synced_at is not None and self.synced_at is not None and synced_at < self.synced_at:
+            # A request that started before the latest sync; keep the newer entries
+            return False
+        self._entries.clear()
+        self.size = 0
+        self.version = version
+        self.synced_at = synced_at
+        return True
+    
+    def get(self, key, version, synced_at):
+        with self._lock:
+            if not self._sync_version(version, synced_at):
+                return None
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+    
+    def put(self, key, version, synced_at, body):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if not self._sync_version(version, synced_at):
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+def read_sync_marker(cursor):
+    """Return (generation, synced_at) written by the last sync that changed data"""
+    cursor.execute("SELECT key, value FROM sync_meta WHERE key IN ('generation', 'synced_at')")
+    meta = dict(cursor.fetchall())
+    synced_at = datetime.datetime.fromisoformat(meta['synced_at']) if 'synced_at' in meta else None
+    return int(meta.get('generation', 0)), synced_at
+
+def sync_version(generation, synced_at):
+    """Tag a snapshot by generation and sync time; a rebuilt database counts generations from 1 again"""
+    if synced_at is None:
+        return str(generation)
+    return f"{generation}.{int(synced_at.timestamp() * 1_000_000)}"
+
+class ChunkedResponseWriter:
+    """Writes a response body with chunked transfer encoding, optionally gzip-compressed
+    
+    A copy of the encoded body is kept up to capture_limit bytes so a streamed
+    response can still be stored in the response cache.
+    """
+    
+    CHUNK_SIZE = 64 * 1024
+    
+    def __init__(self, wfile, compress=False, capture_limit=0, timer=None):
+        self.wfile = wfile
+        self.timer = timer
+        # wbits=31 produces a gzip container
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.pending = []
+        self.pending_size = 0
+        self.capture_limit = capture_limit
+        self.captured = [] if capture_limit else None
+        self.captured_size = 0
+    
+    def write(self, data):
+        if self.compressor:
+            data = self.compressor.compress(data)
+        if not data:
+            return
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.captured is not None:
+            self.captured.append(data)
+            self.captured_size += len(data)
+            if self.captured_size > self.capture_limit:
+                self.captured = None
+        if self.pending_size >= self.CHUNK_SIZE:
+            self.flush_chunk()
+    
+    def flush_chunk(self):
+        if not self.pending_size:
+            return
+        chunk = b''.join(self.pending)
+        previous = self.timer.switch('write') if self.timer else None
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        if self.timer:
+            self.timer.switch(previous)
+        self.pending = []
+        self.pending_size = 0
+    
+    def close(self):
+        """Finish the body; returns the captured encoded bytes, or None if they exceeded the limit"""
+        if self.compressor:
+            tail = self.compressor.flush()
+            self.compressor = None
+            self.write(tail)
+        self.flush_chunk()
+        previous = self.timer.switch('write') if self.timer else None
+        self.wfile.write(b'0\r\n\r\n')
+        if self.timer:
+            self.timer.switch(previous)
+        return b''.join(self.captured) if self.captured is not None else None
+
+def encode_json(value):
+    """Compact UTF-8 JSON used for every response body"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 class DashboardAPI(BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.db_path = "dashboard.db"
-        super().__init__(*args, **kwargs)
+    # Chunked transfer encoding needs HTTP/1.1; connections are still closed
+    # after each response so idle keep-alive clients never hold a worker thread
+    protocol_version = "HTTP/1.1"
+    
+    # Endpoint -> handler method name
+    ENDPOINTS = {
+        '/api/stats': 'get_stats',
+        '/api/data': 'get_data',
+        '/api/projects': 'get_projects',
+        '/api/status': 'get_status_summary',
+        '/api/room': 'get_room',
+        '/api/search': 'get_search',
+        '/api/aggregate': 'get_aggregate',
+        '/api/revenue': 'get_revenue',
+    }
+    
+    # Endpoints that write rows to the socket as they are read from the cursor
+    STREAMING_ENDPOINTS = {'/api/data'}
+    
+    # Smaller bodies are not worth compressing
+    GZIP_MIN_BYTES = 1024
     
     def do_GET(self):
         parsed_url = urlparse(self.path)
         path = parsed_url.path
         query_params = parse_qs(parsed_url.query)
+        self.response_started = False
+        self.response_status = None
+        
+        if path == '/api/metrics':
+            self.send_metrics()
+            return
         
+        if path == '/api/events':
+            self.stream_events()
+            return
+        
+        self.timer = RequestTimer()
+        try:
+            if path == '/api/export':
+                self.handle_export(query_params)
+            else:
+                self.handle_endpoint(path, query_params)
+        finally:
+            self.timer.stop()
+            if path in self.ENDPOINTS or path == '/api/export':
+                self.server.metrics.record(path, self.response_status, self.timer)
+                if self.server.slow_request_ms and self.timer.total * 1000 >= self.server.slow_request_ms:
+                    self.log_slow_request()
+    
+    def handle_endpoint(self, path, query_params):
         try:
             # Route validation
-            valid_endpoints = ['/api/stats', '/api/data', '/api/projects', '/api/status']
-            if path not in valid_endpoints:
+            if path not in self.ENDPOINTS:
                 self.send_error_response(404, "Endpoint not found", {
-                    "available_endpoints": valid_endpoints
+                    "available_endpoints": list(self.ENDPOINTS) + ['/api/export', '/api/metrics', '/api/events']
                 })
                 return
             
-            # Enable CORS
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-            self.end_headers()
+            try:
+                cache_key = self.cache_key(path, query_params)
+            except BadRequest as e:
+                self.send_error_response(400, str(e))
+                return
             
-            if path == '/api/stats':
-                response = self.get_stats()
-            elif path == '/api/data':
-                response = self.get_data(query_params)
-            elif path == '/api/projects':
-                response = self.get_projects()
-            elif path == '/api/status':
-                response = self.get_status_summary()
+            ndjson = self.wants_ndjson(query_params)
+            content_type = 'application/x-ndjson' if ndjson else 'application/json'
+            gzip_body = self.wants_gzip()
+            cache_key += (ndjson, gzip_body)
             
-            self.wfile.write(json.dumps(response, ensure_ascii=False, indent=2).encode('utf-8'))
+            timer = self.timer
+            timer.switch('connect')
+            with self.server.db_pool.connection() as conn:
+                conn.set_progress_handler(timer.count_vm_steps, VM_STEP_INTERVAL)
+                cursor = conn.cursor(TimedCursor)
+                cursor.timer = timer
+                # Read the generation marker and the response from the same snapshot
+                cursor.execute("BEGIN")
+                generation, synced_at = read_sync_marker(cursor)
+                self.version = version = sync_version(generation, synced_at)
+                self.synced_at = synced_at
+                etag = f'W/"{version}"'
+                
+                if self.is_not_modified(etag, synced_at):
+                    timer.switch('write')
+                    self.send_json_headers(304, etag, synced_at)
+                    return
+                
+                body = self.server.response_cache.get(cache_key, version, synced_at)
+                timer.switch('serialize')
+                if body is None and path in self.STREAMING_ENDPOINTS:
+                    self.send_json_headers(200, etag, synced_at, content_type=content_type,
+                                           content_encoding='gzip' if gzip_body else None)
+                    writer = ChunkedResponseWriter(self.wfile, gzip_body, self.server.response_cache.max_entry_bytes, timer)
+                    getattr(self, self.ENDPOINTS[path])(cursor, query_params, writer, ndjson)
+                    body = writer.close()
+                    if body is not None:
+                        self.server.response_cache.put(cache_key, version, synced_at, body)
+                    return
+                
+                if body is None:
+                    # Building the response's dicts from the fetched rows counts as rows, encoding them as serialize
+                    timer.switch('rows')
+                    result = getattr(self, self.ENDPOINTS[path])(cursor, query_params)
+                    timer.switch('serialize')
+                    body = encode_json(result)
+                    if gzip_body and len(body) >= self.GZIP_MIN_BYTES:
+                        body = gzip.compress(body, compresslevel=6)
+                    self.server.response_cache.put(cache_key, version, synced_at, body)
             
+            # Cached bodies are stored already encoded; the gzip magic number tells which
+            timer.switch('write')
+            content_encoding = 'gzip' if body[:2] == b'\x1f\x8b' else None
+            self.send_json_headers(200, etag, synced_at, len(body), content_type, content_encoding)
+            self.wfile.write(body)
+        
         except Exception as e:
-            self.send_error_response(500, "Internal server error", {"details": str(e)})
+            if self.response_started:
+                # Too late for an error status; drop the connection so the client sees a truncated body
+                self.log_error("Error while streaming response: %s", e)
+                self.close_connection = True
+            else:
+                self.send_error_response(500, "Internal server error", {"details": str(e)})
     
-    def send_error_response(self, status_code, message, extra_data=None):
-        """Send structured error response"""
-        self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
+    def handle_export(self, query_params):
+        """Serve every row matching the /api/search filters as a CSV or columnar file
+        
+        The first request for a sync generation streams the file straight from
+        the cursor while saving it to the export cache; repeats are sent from
+        that file with sendfile() and no database work at all.
+        """
+        try:
+            try:
+                export_format, where_sql, params = build_export_query(query_params)
+            except BadRequest as e:
+                self.send_error_response(400, str(e))
+                return
+            content_type, extension = EXPORT_FORMATS[export_format]
+            
+            timer = self.timer
+            timer.switch('connect')
+            with self.server.db_pool.connection() as conn:
+                conn.set_progress_handler(timer.count_vm_steps, VM_STEP_INTERVAL)
+                cursor = conn.cursor(TimedCursor)
+                cursor.timer = timer
+                cursor.execute("BEGIN")
+                generation, synced_at = read_sync_marker(cursor)
+                version = sync_version(generation, synced_at)
+                etag = f'W/"{version}"'
+                filename = f"dashboard-{generation}{extension}"
+                cache_key = (where_sql, tuple(params))
+                
+                if self.is_not_modified(etag, synced_at):
+                    timer.switch('write')
+                    self.send_json_headers(304, etag, synced_at)
+                    return
+                
+                export_file = self.server.exports.open(version, cache_key, export_format)
+                if export_file is None:
+                    timer.switch('serialize')
+                    self.send_json_headers(200, etag, synced_at, content_type=content_type, filename=filename)
+                    writer = ChunkedResponseWriter(self.wfile, timer=timer)
+                    with self.server.exports.create(version, cache_key, export_format) as f:
+                        write_export(cursor, where_sql, params, export_format, TeeFile(writer, f))
+                    writer.close()
+                    return
+            
+            # The cached file is already a complete snapshot, so the connection is back in the pool
+            with export_file:
+                timer.switch('write')
+                self.send_json_headers(200, etag, synced_at, os.fstat(export_file.fileno()).st_size,
+                                       content_type, filename=filename)
+                self.request.sendfile(export_file)
+        
+        except Exception as e:
+            if self.response_started:
+                self.log_error("Error while streaming export: %s", e)
+                self.close_connection = True
+            else:
+                self.send_error_response(500, "Internal server error", {"details": str(e)})
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def stream_events(self):
+        """Open a Server-Sent Events stream and hand the connection to the broadcaster thread"""
+        if not self.server.events.has_room():
+            self.send_error_response(503, "Too many event stream clients")
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        # The stream ends when either side closes the connection
+        self.send_header('Connection', 'close')
+        # Tell nginx not to buffer this response
+        self.send_header('X-Accel-Buffering', 'no')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
+        # Reconnect delay for EventSource after the connection drops
+        self.wfile.write(b'retry: 5000\n\n')
         
+        self.close_connection = True
+        self.server.detach_request(self.request)
+        self.server.events.add_client(self.request.dup())
+    
+    def send_metrics(self):
+        """Serve the request metrics in Prometheus text format"""
+        body = self.server.metrics.render(self.server.response_cache, self.server.events).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_slow_request(self):
+        """Print a request that exceeded the slow-query threshold with its phases and SQL"""
+        timer = self.timer
+        phases = " ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in timer.phases.items())
+        print(f"SLOW {timer.total * 1000:.1f}ms {self.command} {self.path} status={self.response_status} "
+              f"rows={timer.rows} vm_steps={timer.vm_steps} {phases}", flush=True)
+        for sql, parameters, seconds in timer.statements:
+            print(f"  {seconds * 1000:8.1f}ms  {' '.join(sql.split())}  {list(parameters)}", flush=True)
+    
+    def wants_ndjson(self, query_params):
+        """NDJSON is selected with ?format=ndjson or an Accept: application/x-ndjson header"""
+        return (query_params.get('format', [''])[0] == 'ndjson'
+                or 'application/x-ndjson' in self.headers.get('Accept', ''))
+    
+    def wants_gzip(self):
+        """Whether Accept-Encoding allows gzip: a gzip entry decides, else a * entry, and q=0 refuses"""
+        qualities = {}
+        for entry in self.headers.get('Accept-Encoding', '').split(','):
+            coding, *parameters = (part.strip() for part in entry.split(';'))
+            quality = 1.0
+            for parameter in parameters:
+                name, _, value = parameter.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[coding.lower()] = quality
+        quality = qualities.get('gzip', qualities.get('*', 0.0))
+        return quality > 0
+    
+    def cache_key(self, path, query_params):
+        """Normalize a request into a response cache key"""
+        if path == '/api/data':
+            # Requests that resolve to the same SQL share one entry
+            sql, params = build_data_query(query_params)[:2]
+            return (path, sql, tuple(params))
+        if path == '/api/room':
+            return (path,) + self.room_key(query_params)
+        if path == '/api/search':
+            page_sql, page_params, facets_sql, facets_params = build_search_query(query_params)[:4]
+            return (path, page_sql, tuple(page_params), facets_sql, tuple(facets_params))
+        if path == '/api/aggregate':
+            group_by, filters, measures, limit = parse_aggregate_params(query_params)
+            return (path, group_by, tuple(sorted(filters.items())), measures, limit)
+        if path == '/api/revenue':
+            sql, params, _, limit = build_revenue_query(query_params)
+            return (path, sql, tuple(params), limit)
+        return (path,)
+    
+    def is_not_modified(self, etag, synced_at):
+        """Evaluate If-None-Match / If-Modified-Since against the current sync"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # Weak comparison: W/"tag" and "tag" name the same sync
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or etag.removeprefix('W/') in tags
+        
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and synced_at is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                # asctime and "-0000" dates parse naive; HTTP dates are always GMT
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            return synced_at.astimezone(datetime.timezone.utc).replace(microsecond=0) <= since
+        return False
+    
+    def send_json_headers(self, status_code, etag, synced_at, content_length=None,
+                          content_type='application/json', content_encoding=None, filename=None):
+        """Send the status line and headers of a cacheable JSON response
+        
+        Without a content_length the body is sent with chunked transfer encoding.
+        A filename marks the body as a download.
+        """
+        self.response_started = True
+        self.send_response(status_code)
+        self.send_header('Content-type', content_type)
+        if status_code != 304:
+            if content_length is None:
+                self.send_header('Transfer-Encoding', 'chunked')
+            else:
+                self.send_header('Content-Length', str(content_length))
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        self.send_header('Connection', 'close')
+        # Enable CORS
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        # Let browsers keep responses but revalidate them against the current sync
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('ETag', etag)
+        if synced_at is not None:
+            self.send_header('Last-Modified', email.utils.format_datetime(synced_at.astimezone(datetime.timezone.utc), usegmt=True))
+        self.end_headers()
+    
+    def send_error_response(self, status_code, message, extra_data=None):
+        """Send structured error response"""
         error_response = {"error": message}
         if extra_data:
             error_response.update(extra_data)
+        body = json.dumps(error_response).encode('utf-8')
         
-        self.wfile.write(json.dumps(error_response).encode('utf-8'))
+        self.send_response(status_code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        
+        self.wfile.write(body)
     
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.send_header('Connection', 'close')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
     
-    def get_stats(self):
+    def get_stats(self, cursor, query_params):
         """Get database statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         stats = {}
         
-        # Total records
-        cursor.execute("SELECT COUNT(*) FROM dashboard_data")
-        stats['total_records'] = cursor.fetchone()[0]
-        
-        # Unique projects
-        cursor.execute("SELECT COUNT(DISTINCT project_code) FROM dashboard_data WHERE project_code != ''")
-        stats['unique_projects'] = cursor.fetchone()[0]
+        # Total records and unique projects
+        cursor.execute(TOTALS_SQL)
+        stats['total_records'], stats['unique_projects'] = cursor.fetchone()
         
         # Install status breakdown
-        cursor.execute("SELECT install_status, COUNT(*) FROM dashboard_data WHERE install_status != '' GROUP BY install_status ORDER BY COUNT(*) DESC")
+        cursor.execute(STATUS_BREAKDOWN_SQL)
         stats['install_status_breakdown'] = dict(cursor.fetchall())
         
         # Monthly breakdown
-        cursor.execute("SELECT sales_year, sales_month, COUNT(*) FROM dashboard_data WHERE sales_year IS NOT NULL AND sales_month IS NOT NULL GROUP BY sales_year, sales_month ORDER BY sales_year DESC, sales_month DESC LIMIT 12")
+        cursor.execute(MONTHLY_BREAKDOWN_SQL)
         monthly_data = cursor.fetchall()
         stats['monthly_breakdown'] = [{"year": year, "month": month, "count": count} for year, month, count in monthly_data]
         
         # Top brands
-        cursor.execute("SELECT brand, COUNT(*) FROM dashboard_data WHERE brand != '' GROUP BY brand ORDER BY COUNT(*) DESC LIMIT 10")
+        cursor.execute(TOP_BRANDS_SQL)
         stats['top_brands'] = dict(cursor.fetchall())
         
-        conn.close()
         return stats
     
-    def get_data(self, query_params):
-        """Get filtered data"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Enable column access by name
-        cursor = conn.cursor()
-        
-        # Build query with filters
-        where_conditions = []
-        params = []
-        
-        if 'project_code' in query_params:
-            project_code = query_params['project_code'][0].strip()
-            if project_code:
-                where_conditions.append("project_code = ?")
-                params.append(project_code)
-        
-        if 'install_status' in query_params:
-            install_status = query_params['install_status'][0].strip()
-            if install_status:
-                where_conditions.append("install_status = ?")
-                params.append(install_status)
-        
-        if 'brand' in query_params:
-            brand = query_params['brand'][0].strip()
-            if brand:
-                where_conditions.append("brand = ?")
-                params.append(brand)
-        
-        # Pagination with validation
-        try:
-            limit = min(int(query_params.get('limit', [100])[0]), 1000)  # Max 1000 records
-            offset = max(int(query_params.get('offset', [0])[0]), 0)    # Min 0
-        except (ValueError, IndexError):
-            limit = 100
-            offset = 0
-        
-        # Build final query
-        base_query = """
-            SELECT order_number, order_date, project_code, project_name, unit_no, house_number,
-                   contact_name, contact_phone, product_detail, brand, product_size,
-                   install_date, install_status, document_status, building, floor_level,
-                   items_group, room_type, install_point, color, sync_timestamp
-            FROM dashboard_data
-        """
+    def get_data(self, cursor, query_params, writer, ndjson=False):
+        """Stream filtered data straight from the cursor into writer"""
+        base_query, params, limit, offset = build_data_query(query_params)
+        cursor.execute(base_query, params)
         
-        if where_conditions:
-            base_query += " WHERE " + " AND ".join(where_conditions)
+        returned_count = 0
+        last_row = None
+        has_more = False
         
-        base_query += " ORDER BY order_date DESC LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
+        if not ndjson:
+            writer.write(b'{"data":[')
         
-        cursor.execute(base_query, params)
-        rows = cursor.fetchall()
+        while not has_more:
+            rows = cursor.fetchmany(DATA_FETCH_SIZE)
+            if not rows:
+                break
+            if returned_count + len(rows) > limit:
+                # The extra row fetched by build_data_query means another page follows
+                rows = rows[:limit - returned_count]
+                has_more = True
+            if not rows:
+                break
+            
+            previous = self.timer.switch('rows')
+            items = [dict(zip(DATA_FIELDS, row)) for row in rows]
+            self.timer.switch(previous)
+            if ndjson:
+                writer.write(b''.join(encode_json(item) + b'\n' for item in items))
+            else:
+                # Encode the whole batch as one array and splice its elements in
+                batch = encode_json(items)[1:-1]
+                writer.write(b',' + batch if returned_count else batch)
+            
+            returned_count += len(rows)
+            last_row = rows[-1]
         
-        # Convert to list of dictionaries
-        data = []
-        for row in rows:
-            data.append({
-                "order_number": row["order_number"],
-                "order_date": row["order_date"],
-                "project_code": row["project_code"],
-                "project_name": row["project_name"],
-                "unit_no": row["unit_no"],
-                "house_number": row["house_number"],
-                "contact_name": row["contact_name"],
-                "contact_phone": row["contact_phone"],
-                "product_detail": row["product_detail"],
-                "brand": row["brand"],
-                "product_size": row["product_size"],
-                "install_date": row["install_date"],
-                "install_status": row["install_status"],
-                "document_status": row["document_status"],
-                "building": row["building"],
-                "floor_level": row["floor_level"],
-                "items_group": row["items_group"],
-                "room_type": row["room_type"],
-                "install_point": row["install_point"],
-                "color": row["color"],
-                "sync_timestamp": row["sync_timestamp"]
-            })
+        pagination = {
+            "limit": limit,
+            "offset": offset,
+            "returned_count": returned_count,
+            "has_more": has_more,
+            "next_cursor": encode_cursor(last_row[DATA_ORDER_DATE], last_row[DATA_ID]) if has_more else None
+        }
+        
+        if ndjson:
+            # Bulk consumers get the pagination block as the final line
+            writer.write(encode_json({"pagination": pagination}) + b'\n')
+        else:
+            writer.write(b'],"pagination":' + encode_json(pagination) + b'}')
+    
+    def row_to_dict(self, row):
+        """Convert a DATA_SELECT_SQL row to its JSON shape"""
+        return dict(zip(DATA_FIELDS, row))
+    
+    def room_key(self, query_params):
+        """Return the (project_code, unit_no) a /api/room request asks for"""
+        project_code = query_params.get('project_code', [''])[0].strip()
+        unit_no = query_params.get('unit_no', [''])[0].strip()
+        if not project_code or not unit_no:
+            raise BadRequest("project_code and unit_no are required")
+        return project_code, unit_no
+    
+    def get_room(self, cursor, query_params):
+        """Get every item installed in one room"""
+        project_code, unit_no = self.room_key(query_params)
+        
+        cursor.execute(ROOM_SQL, (project_code, unit_no))
+        items = [self.row_to_dict(row) for row in cursor.fetchall()]
+        
+        room = None
+        if items:
+            first = items[0]
+            room = {
+                "project_code": first["project_code"],
+                "project_name": first["project_name"],
+                "unit_no": first["unit_no"],
+                "house_number": first["house_number"],
+                "contact_name": first["contact_name"]
+            }
+        
+        return {"room": room, "items": items}
+    
+    def get_search(self, cursor, query_params):
+        """Get one page of matching rows together with the total and per-facet counts"""
+        page_sql, page_params, facets_sql, facets_params, limit, offset = build_search_query(query_params)
+        
+        cursor.execute(facets_sql, facets_params)
+        total = 0
+        facets = {facet: [] for facet in FACETS}
+        for facet, value, count in cursor.fetchall():
+            if facet is None:
+                total = count
+            else:
+                facets[facet].append({"value": value, "count": count})
+        
+        cursor.execute(page_sql, page_params)
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
-        conn.close()
         return {
-            "data": data,
+            "data": [self.row_to_dict(row) for row in rows],
+            "total": total,
+            "facets": facets,
             "pagination": {
                 "limit": limit,
                 "offset": offset,
-                "returned_count": len(data)
+                "returned_count": len(rows),
+                "has_more": has_more,
+                "next_cursor": encode_cursor(rows[-1][DATA_ORDER_DATE], rows[-1][DATA_ID]) if has_more else None
             }
         }
     
-    def get_projects(self):
+    def get_aggregate(self, cursor, query_params):
+        """Get counts and sums grouped by any combination of dimensions"""
+        group_by, filters, measures, limit = parse_aggregate_params(query_params)
+        
+        if self.server.columnar is not None:
+            snapshot = self.server.columnar.get(self.version, self.synced_at, cursor)
+            total, groups = snapshot.aggregate(group_by, filters, measures)
+            engine = "columnar"
+        else:
+            cursor.execute(*build_aggregate_query(group_by, filters, measures))
+            groups = [(row[:len(group_by)], row[len(group_by)], dict(zip(measures, row[len(group_by) + 1:])))
+                      for row in cursor.fetchall()]
+            total = sum(count for _, count, _ in groups)
+            engine = "sqlite"
+        
+        groups.sort(key=lambda group: (-group[1], ['' if value is None else str(value) for value in group[0]]))
+        results = []
+        for key, count, sums in groups[:limit]:
+            result = dict(zip(group_by, key))
+            result["count"] = count
+            for name in measures:
+                result[name] = round(sums[name], 2)
+            results.append(result)
+        
+        return {
+            "group_by": list(group_by),
+            "measures": list(measures),
+            "total": total,
+            "group_count": len(groups),
+            "groups": results,
+            "engine": engine
+        }
+    
+    def get_revenue(self, cursor, query_params):
+        """Get sales, costs and margins grouped by project, brand, items group, supplier and period"""
+        sql, params, group_by, limit = build_revenue_query(query_params)
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        
+        fields = group_by + REVENUE_FIELDS
+        width = len(fields)
+        # Without group_by an empty match still yields one row, with a NULL count
+        rows = [row for row in rows if row[len(group_by)]]
+        
+        return {
+            "group_by": list(group_by),
+            "totals": revenue_totals(rows[0][width], rows[0][width + 1:]) if rows else revenue_totals(0, [0.0] * len(AGGREGATE_MEASURES)),
+            "group_count": len(rows),
+            "groups": [dict(zip(fields, row)) for row in rows[:limit]]
+        }
+    
+    def get_projects(self, cursor, query_params):
         """Get list of projects"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT project_code, project_name, COUNT(*) as record_count,
-                   MAX(install_date) as latest_install
-            FROM dashboard_data 
-            WHERE project_code != '' 
-            GROUP BY project_code, project_name 
-            ORDER BY record_count DESC
-        """)
+        cursor.execute(PROJECTS_SQL)
+        rows = cursor.fetchall()
         
         projects = []
-        for row in cursor.fetchall():
+        for row in rows:
             projects.append({
                 "project_code": row[0],
                 "project_name": row[1],
@@ -211,50 +1564,361 @@ class DashboardAPI(BaseHTTPRequestHandler):
                 "latest_install": row[3]
             })
         
-        conn.close()
         return {"projects": projects}
     
-    def get_status_summary(self):
+    def get_status_summary(self, cursor, query_params):
         """Get installation status summary"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT install_status, COUNT(*) as count,
-                   ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM dashboard_data), 2) as percentage
-            FROM dashboard_data 
-            WHERE install_status != ''
-            GROUP BY install_status 
-            ORDER BY count DESC
-        """)
+        cursor.execute(STATUS_SUMMARY_SQL)
+        rows = cursor.fetchall()
         
         status_summary = []
-        for row in cursor.fetchall():
+        for row in rows:
             status_summary.append({
                 "status": row[0],
                 "count": row[1],
                 "percentage": row[2]
             })
         
-        conn.close()
         return {"status_summary": status_summary}
 
-def run_server(port=3001):
+def explain_queries(db_path=DEFAULT_DB_PATH):
+    """Print EXPLAIN QUERY PLAN for every API query; returns False if any does a full table scan"""
+    sample = {column: ['x'] for column in DATA_FILTERS}
+    queries = [
+        ("stats: totals", TOTALS_SQL, []),
+        ("stats: install status breakdown", STATUS_BREAKDOWN_SQL, []),
+        ("stats: monthly breakdown", MONTHLY_BREAKDOWN_SQL, []),
+        ("stats: top brands", TOP_BRANDS_SQL, []),
+        ("projects", PROJECTS_SQL, []),
+        ("status", STATUS_SUMMARY_SQL, []),
+        ("data", *build_data_query({})[:2]),
+    ]
+    for column in DATA_FILTERS:
+        queries.append((f"data ?{column}=", *build_data_query({column: sample[column]})[:2]))
+    queries.append(("data with all filters", *build_data_query(sample)[:2]))
+    queries.append(("data ?cursor=", *build_data_query({'cursor': [encode_cursor('x', 1)]})[:2]))
+    queries.append(("room", ROOM_SQL, ['x', 'x']))
+    search = build_search_query({'q': ['xyz'], 'building': ['x'], 'install_from': ['2024-01-01']})
+    queries.append(("search ?q=&building=&install_from=: page", search[0], search[1]))
+    queries.append(("search ?q=&building=&install_from=: facets", search[2], search[3]))
+    search = build_search_query({'project_code': ['x'], 'room_type': ['x', 'y']})
+    queries.append(("search ?project_code=&room_type=: facets", search[2], search[3]))
+    _, export_where, export_params = build_export_query({'project_code': ['x']})
+    queries.append(("export ?project_code=", f"SELECT * FROM dashboard_data{export_where} ORDER BY id", export_params))
+    queries.append(("revenue ?group_by=brand,sales_month&sales_year=", *build_revenue_query({'group_by': ['brand,sales_month'], 'sales_year': ['2024']})[:2]))
+    
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    all_indexed = True
+    for label, sql, params in queries:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        # A bare "SCAN dashboard_rows" means no index is used at all
+        full_scan = any(step == "SCAN dashboard_rows" for step in plan)
+        all_indexed = all_indexed and not full_scan
+        print(f"{'FULL SCAN' if full_scan else 'ok':>9}  {label}")
+        for step in plan:
+            print(f"           {step}")
+    conn.close()
+    return all_indexed
+
+def available_cpus():
+    """CPUs this process may run on, honouring the container's cpuset"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+class PreforkSupervisor:
+    """Runs one ThreadPoolHTTPServer process per CPU, all accepting on the same port
+    
+    The supervisor binds one SO_REUSEPORT socket per worker slot and keeps
+    every one open, so the kernel spreads connections across the slots and a
+    slot's queued connections survive while its worker is replaced: the new
+    worker inherits the same socket, and the old one is only told to stop once
+    the new one is ready, after which it finishes the requests it accepted.
+    
+    With snapshot=True each worker answers from its own in-memory copy of the
+    database, so a new sync generation rolls the workers onto fresh copies one
+    slot at a time. Otherwise workers read the database file directly and only
+    the SIGUSR1 from the sync daemon is passed on, for /api/events.
+    """
+    
+    READY_TIMEOUT = 120.0
+    # Minimum time between restarts of a worker that keeps exiting
+    RESTART_DELAY = 1.0
+    
+    def __init__(self, server_address, processes, db_path=DEFAULT_DB_PATH, snapshot=DEFAULT_SNAPSHOT,
+                 poll_interval=DEFAULT_EVENTS_POLL, **server_options):
+        self.server_address = server_address
+        self.db_path = db_path
+        self.snapshot = snapshot
+        self.poll_interval = poll_interval
+        self.server_options = server_options
+        self.sockets = [self.listen(server_address) for _ in range(processes)]
+        self.workers = [None] * processes
+        self.started = [0.0] * processes
+        self.retiring = set()
+        self.generation = None
+        self.signalled = False
+        self.stopping = False
+        self._wake = threading.Event()
+    
+    def listen(self, server_address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(server_address)
+        sock.listen(ThreadPoolHTTPServer.request_queue_size)
+        # Old and new workers briefly share a slot; whichever loses the race for a connection must not block in accept()
+        sock.setblocking(False)
+        return sock
+    
+    def read_generation(self):
+        try:
+            conn = sqlite3.connect(Path(self.db_path).resolve().as_uri() + "?mode=ro", uri=True, timeout=10.0)
+            try:
+                return read_sync_marker(conn.cursor())[0]
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not read the sync generation: {e}")
+            return self.generation
+    
+    def spawn(self, slot):
+        """Fork a worker for slot and wait until it serves; returns its pid, or None if it failed to start"""
+        ready_read, ready_write = os.pipe()
+        # Otherwise the child would print whatever the supervisor still has buffered
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 1
+            try:
+                self.run_worker(slot, ready_write)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        
+        os.close(ready_write)
+        try:
+            readable, _, _ = select.select([ready_read], [], [], self.READY_TIMEOUT)
+            ready = bool(readable) and os.read(ready_read, 1) == b'1'
+        finally:
+            os.close(ready_read)
+        if not ready:
+            print(f"Worker {slot} (pid {pid}) did not start")
+            self.terminate(pid)
+            return None
+        self.started[slot] = time.monotonic()
+        return pid
+    
+    def run_worker(self, slot, ready_fd):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for index, sock in enumerate(self.sockets):
+            if index != slot:
+                sock.close()
+        
+        httpd = ThreadPoolHTTPServer(self.server_address, DashboardAPI, self.db_path, listen_socket=self.sockets[slot],
+                                     snapshot=self.snapshot, **self.server_options)
+        # shutdown() waits for serve_forever() to return, so it cannot run in this (the serving) thread
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: httpd.events.notify())
+        os.write(ready_fd, b'1')
+        os.close(ready_fd)
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+    
+    def terminate(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            self.retiring.add(pid)
+        except ProcessLookupError:
+            pass
+    
+    def reap(self):
+        """Collect exited workers and restart any that were still meant to be serving"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            self.retiring.discard(pid)
+            if pid in self.workers:
+                slot = self.workers.index(pid)
+                self.workers[slot] = None
+                print(f"Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+        
+        for slot, pid in enumerate(self.workers):
+            if pid is None and not self.stopping and time.monotonic() - self.started[slot] >= self.RESTART_DELAY:
+                self.workers[slot] = self.spawn(slot)
+                # Count failed starts too, so a broken worker is retried at most once per RESTART_DELAY
+                self.started[slot] = time.monotonic()
+    
+    def roll(self, generation):
+        """Replace every worker, one slot at a time, with one serving the current data"""
+        print(f"Rolling {len(self.workers)} workers onto generation {generation}")
+        for slot, old in enumerate(self.workers):
+            if self.stopping:
+                return
+            new = self.spawn(slot)
+            if new is None:
+                # Keep the old worker serving rather than leave the slot empty
+                continue
+            self.workers[slot] = new
+            if old is not None:
+                self.terminate(old)
+    
+    def notify(self):
+        """The sync daemon's SIGUSR1; handled by the run() loop"""
+        self.signalled = True
+        self._wake.set()
+    
+    def child_exited(self):
+        """SIGCHLD: reap right away so a crashed worker's slot is not left without one"""
+        self._wake.set()
+    
+    def stop(self):
+        self.stopping = True
+        self._wake.set()
+    
+    def run(self):
+        self.generation = self.read_generation()
+        for slot in range(len(self.workers)):
+            self.workers[slot] = self.spawn(slot)
+        
+        while not self.stopping:
+            # Snapshot workers cannot see new data themselves, so check the generation even without a signal
+            self._wake.wait(min(self.poll_interval, self.RESTART_DELAY) if None in self.workers else self.poll_interval)
+            self._wake.clear()
+            self.reap()
+            if self.stopping:
+                break
+            
+            signalled, self.signalled = self.signalled, False
+            if self.snapshot:
+                generation = self.read_generation()
+                if generation != self.generation:
+                    self.roll(generation)
+                    # Anything synced during the roll shows up as another change next time round
+                    self.generation = generation
+            elif signalled:
+                for pid in self.workers:
+                    if pid is not None:
+                        try:
+                            os.kill(pid, signal.SIGUSR1)
+                        except ProcessLookupError:
+                            pass
+        
+        for pid in self.workers:
+            if pid is not None:
+                self.terminate(pid)
+        for pid in list(self.retiring):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        for sock in self.sockets:
+            sock.close()
+
+def stop_server(signum, frame):
+    raise KeyboardInterrupt
+
+def run_server(port=3001, mode=DEFAULT_SERVER_MODE, workers=DEFAULT_WORKERS,
+               pool_size=DEFAULT_POOL_SIZE, db_path=DEFAULT_DB_PATH, cache_bytes=DEFAULT_CACHE_BYTES,
+               slow_request_ms=DEFAULT_SLOW_REQUEST_MS, pidfile=DEFAULT_PIDFILE, columnar=DEFAULT_COLUMNAR,
+               processes=DEFAULT_PROCESSES, snapshot=DEFAULT_SNAPSHOT):
     server_address = ('', port)
-    httpd = HTTPServer(server_address, DashboardAPI)
+    if mode == "prefork":
+        processes = processes or available_cpus()
+        httpd = PreforkSupervisor(server_address, processes, db_path, snapshot, pool_size=pool_size, workers=workers,
+                                  cache_bytes=cache_bytes, slow_request_ms=slow_request_ms, columnar=columnar)
+    elif mode == "single":
+        httpd = DashboardHTTPServer(server_address, DashboardAPI, db_path, cache_bytes=cache_bytes,
+                                    slow_request_ms=slow_request_ms, columnar=columnar)
+    else:
+        httpd = ThreadPoolHTTPServer(server_address, DashboardAPI, db_path, pool_size, workers, cache_bytes,
+                                     slow_request_ms, columnar)
     print(f"Dashboard API server running on http://localhost:{port}")
+    if mode == "prefork":
+        print(f"Serving mode: prefork ({processes} processes x {workers} workers, "
+              f"{'in-memory snapshot per process' if snapshot else f'{pool_size} pooled connections each'})")
+    elif mode == "single":
+        print("Serving mode: single-threaded")
+    else:
+        print(f"Serving mode: threaded ({workers} workers, {pool_size} pooled connections)")
     print("Available endpoints:")
     print("  GET /api/stats - Database statistics")
-    print("  GET /api/data - Get filtered data (supports ?project_code=, ?install_status=, ?brand=, ?limit=, ?offset=)")
+    print("  GET /api/data - Get filtered data (supports ?project_code=, ?install_status=, ?brand=, ?unit_no=, ?limit=, ?cursor=, ?offset=)")
+    print("  GET /api/room - All items of one room (requires ?project_code= and ?unit_no=)")
+    print("  GET /api/search - Faceted search (multi-value filters, ?install_from=/?install_to=, ?q= text search)")
     print("  GET /api/projects - List all projects")
     print("  GET /api/status - Installation status summary")
+    print("  GET /api/revenue - Sales, costs and margins from the revenue cubes")
+    print("  GET /api/export - Every matching row as CSV or columnar (?format=csv|columnar, /api/search filters)")
+    print(f"  GET /api/aggregate - Counts and sums by any dimensions ({'columnar snapshot' if columnar else 'SQLite'})")
+    print("  GET /api/metrics - Request timings in Prometheus text format")
+    print("  GET /api/events - Server-Sent Events stream announcing each sync")
+    if slow_request_ms:
+        print(f"Logging requests slower than {slow_request_ms:g} ms")
     print("\nPress Ctrl+C to stop the server")
     
+    # The sync daemon signals this process when new data is live
+    if mode == "prefork":
+        signal.signal(signal.SIGUSR1, lambda signum, frame: httpd.notify())
+        signal.signal(signal.SIGCHLD, lambda signum, frame: httpd.child_exited())
+        signal.signal(signal.SIGTERM, lambda signum, frame: httpd.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: httpd.stop())
+    else:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: httpd.events.notify())
+        signal.signal(signal.SIGTERM, stop_server)
+    if pidfile:
+        with open(pidfile, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+    
     try:
-        httpd.serve_forever()
+        if mode == "prefork":
+            httpd.run()
+            print("\nServer stopped")
+        else:
+            httpd.serve_forever()
     except KeyboardInterrupt:
         print("\nServer stopped")
         httpd.server_close()
+    finally:
+        if pidfile and os.path.exists(pidfile):
+            os.remove(pidfile)
 
 if __name__ == "__main__":
-    run_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Dashboard API server")
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "3001")))
+    parser.add_argument("--mode", choices=["threaded", "single", "prefork"], default=DEFAULT_SERVER_MODE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker threads in threaded mode, per process in prefork mode")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES,
+                        help="Worker processes in prefork mode (0 = one per available CPU)")
+    parser.add_argument("--snapshot", action="store_true", default=DEFAULT_SNAPSHOT,
+                        help="In prefork mode, serve each process from an in-memory copy of the database")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="Pooled read-only SQLite connections")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--cache-bytes", type=int, default=DEFAULT_CACHE_BYTES, help="Response cache budget (0 disables caching)")
+    parser.add_argument("--slow-ms", type=float, default=DEFAULT_SLOW_REQUEST_MS,
+                        help="Log requests slower than this many milliseconds with their SQL (0 disables)")
+    parser.add_argument("--pidfile", default=DEFAULT_PIDFILE, help="Where to write the pid the sync daemon signals (empty to skip)")
+    parser.add_argument("--columnar", action="store_true", default=DEFAULT_COLUMNAR,
+                        help="Serve /api/aggregate from an in-memory columnar snapshot")
+    parser.add_argument("--explain", action="store_true", help="Print the query plan of every API query and exit")
+    args = parser.parse_args()
+    if args.explain:
+        raise SystemExit(0 if explain_queries(args.db) else 1)
+    run_server(args.port, args.mode, args.workers, args.pool_size, args.db, args.cache_bytes, args.slow_ms, args.pidfile, args.columnar,
+               args.processes, args.snapshot)
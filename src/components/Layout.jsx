@@ -1,6 +1,9 @@
 import { Outlet } from 'react-router-dom';
+import { useSyncEvents } from '../hooks/useSyncEvents';
 
 const Layout = () => {
+  useSyncEvents();
+
   return (
     <div className="min-h-screen bg-gradient-to-br from-gray-50 to-blue-50">
       {/* Header */}
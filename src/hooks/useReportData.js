@@ -9,7 +9,11 @@ export const useReportData = (searchFilters = {}) => {
     queryKey: ['reportData', searchFilters],
     queryFn: async () => {
       try {
-        const rawData = await apiService.getAllData();
+        // Customer names are matched by the server's search index instead of in the browser
+        const { data: rawData } = await apiService.searchData({
+          contact_name: searchFilters.customerName,
+          limit: 1000
+        });
         return apiService.transformToReportData(rawData);
       } catch (error) {
         console.error('Error fetching data from API, using mock data:', error);
@@ -23,13 +27,10 @@ export const useReportData = (searchFilters = {}) => {
         const matchesRoom = !searchFilters.roomNumber || 
           item.roomNumber.toLowerCase().includes(searchFilters.roomNumber.toLowerCase());
         
-        const matchesCustomer = !searchFilters.customerName || 
-          item.customerName.toLowerCase().includes(searchFilters.customerName.toLowerCase());
-        
         const matchesAddress = !searchFilters.addressNo || 
           item.addressNo.toLowerCase().includes(searchFilters.addressNo.toLowerCase());
         
-        return matchesRoom && matchesCustomer && matchesAddress;
+        return matchesRoom && matchesAddress;
       });
     },
     staleTime: CONFIG.QUERY_CONFIG.STALE_TIME,
@@ -0,0 +1,28 @@
+import { useEffect } from 'react';
+import { useQueryClient } from '@tanstack/react-query';
+import { CONFIG } from '../constants/config.js';
+
+// Refetch cached queries whenever the server announces that a sync changed the data
+export const useSyncEvents = () => {
+  const queryClient = useQueryClient();
+
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') {
+      return undefined;
+    }
+
+    const source = new EventSource(`${CONFIG.API_BASE_URL}/events`);
+    let generation = null;
+
+    source.addEventListener('sync', (event) => {
+      const { generation: latest } = JSON.parse(event.data);
+      // The first event (and the one after a reconnect) may just repeat what we already have
+      if (generation !== null && latest !== generation) {
+        queryClient.invalidateQueries();
+      }
+      generation = latest;
+    });
+
+    return () => source.close();
+  }, [queryClient]);
+};
@@ -63,6 +63,27 @@ class ApiService {
     }
   }
 
+  async searchData(filters = {}) {
+    // Filtering and facet counts happen on the server; see /api/search in README.md
+    const url = new URL(`${CONFIG.API_BASE_URL}/search`, window.location.origin);
+    Object.entries(filters).forEach(([key, value]) => {
+      // Arrays become repeated parameters (?building=A&building=B)
+      [].concat(value).forEach(item => {
+        if (item !== null && item !== undefined && item !== '') {
+          url.searchParams.append(key, item);
+        }
+      });
+    });
+
+    const response = await this.fetchData(`/search?${url.searchParams}`);
+    return {
+      data: response.data || [],
+      total: response.total || 0,
+      facets: response.facets || {},
+      pagination: response.pagination || {}
+    };
+  }
+
   async getRoomDetails(roomNumber) {
     if (!roomNumber) return { roomInfo: null, items: [] };
     
@@ -75,20 +96,12 @@ class ApiService {
     const projectCode = roomParts[0];
     const unitNo = roomParts.slice(1).join('-'); // Handle cases like "SKWG2-B1-308"
     
-    // Get all data for this project first
-    const params = {
-      limit: 1000
-    };
-    
-    const response = await this.fetchData('/data', params);
-    const allData = response.data || [];
-    
-    // Filter for exact room match
-    const roomData = allData.filter(item => {
-      const itemProjectCode = item.project_code || '';
-      const itemUnitNo = item.unit_no || '';
-      return itemProjectCode === projectCode && itemUnitNo === unitNo;
+    // Fetch just this room's items
+    const response = await this.fetchData('/room', {
+      project_code: projectCode,
+      unit_no: unitNo
     });
+    const roomData = response.items || [];
     
     if (roomData.length === 0) {
       return { roomInfo: null, items: [] };
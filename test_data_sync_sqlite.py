@@ -0,0 +1,43 @@
+"""Tests for data_sync_sqlite.py
+
+Run with: python3 -m unittest test_data_sync_sqlite  (or python3 -m pytest)
+"""
+import os
+import tempfile
+import unittest
+
+from data_sync_sqlite import SOURCE_COLUMNS, ParseReport, SheetSource, SQLiteDataSync
+
+HEADER = [f"column {i}" for i in range(len(SOURCE_COLUMNS))]
+
+def sheet_row(order_number, order_date):
+    return [order_number, order_date] + ['x'] * (len(SOURCE_COLUMNS) - 2)
+
+class ParseRowsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sync = SQLiteDataSync(os.path.join(self.directory.name, "dashboard.db"))
+        self.report = ParseReport()
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
+    def parse(self, *rows):
+        return list(self.sync.parse_rows([HEADER, *rows], SheetSource("sheet", "unused"), self.report))
+    
+    def test_blank_rows_are_skipped_not_rejected(self):
+        rows = self.parse(sheet_row("A1", "1/2/2567"), [], [''] * len(HEADER), sheet_row("A2", "2024-02-01"), [])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(self.report.skipped, 3)
+        self.assertEqual(self.report.rejected, {})
+    
+    def test_unreadable_dates_are_reported_with_their_text(self):
+        rows = self.parse(sheet_row("A1", "31/13/2024"), sheet_row("A2", "soon"), sheet_row("A3", "2024-02-01"))
+        self.assertEqual([row[1] for row in rows], ['', '', '2024-02-01'])
+        entry = self.report.invalid_values['order_date']
+        self.assertEqual(entry["rows"], 2)
+        self.assertEqual(list(zip(entry["lines"], entry["values"])), [(2, "31/13/2024"), (3, "soon")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Tests for export_data.py
+
+Run with: python3 -m unittest test_export_data  (or python3 -m pytest)
+"""
+import os
+import tempfile
+import unittest
+
+from export_data import ExportCache
+
+class ExportCachePruneTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ExportCache(self.directory.name)
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
+    def write(self, version):
+        with self.cache.create(version, ('', ()), 'csv') as f:
+            f.write(version.encode())
+    
+    def cached(self, version):
+        return os.path.exists(self.cache.path(version, ('', ()), 'csv'))
+    
+    def test_newer_version_removes_older(self):
+        self.write("5.1000")
+        # A rebuilt database: lower generation, later sync
+        self.write("1.2000")
+        self.assertFalse(self.cached("5.1000"))
+        self.assertTrue(self.cached("1.2000"))
+    
+    def test_late_older_export_keeps_newer(self):
+        self.write("2.2000")
+        self.write("1.1000")
+        self.assertTrue(self.cached("2.2000"))
+        self.assertTrue(self.cached("1.1000"))
+        self.write("3.3000")
+        self.assertFalse(self.cached("2.2000"))
+        self.assertFalse(self.cached("1.1000"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests for simple_api.py
+
+Run with: python3 -m unittest test_simple_api  (or python3 -m pytest)
+"""
+import datetime
+import unittest
+
+from simple_api import DashboardAPI, ResponseCache
+
+SYNCED_AT = datetime.datetime(1994, 11, 6, 8, 49, 37, tzinfo=datetime.timezone.utc)
+
+def request_with(headers):
+    """A handler with only request headers set, enough for the conditional GET checks"""
+    handler = DashboardAPI.__new__(DashboardAPI)
+    handler.headers = headers
+    return handler
+
+class IfModifiedSinceTest(unittest.TestCase):
+    """RFC 9110 allows three HTTP-date formats; all must compare without raising"""
+    
+    def check(self, same_second, earlier):
+        self.assertTrue(request_with({'If-Modified-Since': same_second}).is_not_modified('W/"1"', SYNCED_AT))
+        self.assertFalse(request_with({'If-Modified-Since': earlier}).is_not_modified('W/"1"', SYNCED_AT))
+    
+    def test_imf_fixdate(self):
+        self.check("Sun, 06 Nov 1994 08:49:37 GMT", "Sun, 06 Nov 1994 08:49:36 GMT")
+    
+    def test_rfc850_date(self):
+        self.check("Sunday, 06-Nov-94 08:49:37 GMT", "Sunday, 06-Nov-94 08:49:36 GMT")
+    
+    def test_asctime_date(self):
+        self.check("Sun Nov  6 08:49:37 1994", "Sun Nov  6 08:49:36 1994")
+    
+    def test_unparseable_date_is_modified(self):
+        self.assertFalse(request_with({'If-Modified-Since': "yesterday"}).is_not_modified('W/"1"', SYNCED_AT))
+
+class AcceptEncodingTest(unittest.TestCase):
+
+    def wants_gzip(self, accept_encoding):
+        return request_with({'Accept-Encoding': accept_encoding}).wants_gzip()
+    
+    def test_gzip_accepted(self):
+        self.assertTrue(self.wants_gzip("gzip, deflate, br"))
+        self.assertTrue(self.wants_gzip("br;q=1.0, gzip;q=0.8"))
+        self.assertTrue(self.wants_gzip("*"))
+    
+    def test_gzip_refused(self):
+        self.assertFalse(self.wants_gzip("gzip;q=0"))
+        self.assertFalse(self.wants_gzip("br, gzip; q=0.000"))
+        self.assertFalse(self.wants_gzip("*, gzip;q=0"))
+        self.assertFalse(self.wants_gzip("*;q=0"))
+        self.assertFalse(self.wants_gzip("identity"))
+        self.assertFalse(request_with({}).wants_gzip())
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_older_version_bypasses_cache(self):
+        cache = ResponseCache(1024)
+        newer = SYNCED_AT + datetime.timedelta(minutes=5)
+        cache.put('k', '2.new', newer, b'new')
+        # A request whose transaction began before the sync neither evicts nor sees the newer entries
+        cache.put('k', '1.old', SYNCED_AT, b'old')
+        self.assertIsNone(cache.get('k', '1.old', SYNCED_AT))
+        self.assertEqual(cache.get('k', '2.new', newer), b'new')
+    
+    def test_newer_version_replaces_cache(self):
+        cache = ResponseCache(1024)
+        cache.put('k', '1.old', SYNCED_AT, b'old')
+        newer = SYNCED_AT + datetime.timedelta(minutes=5)
+        self.assertIsNone(cache.get('k', '2.new', newer))
+        self.assertEqual(cache.size, 0)
+
+if __name__ == "__main__":
+    unittest.main()